@@ -2,58 +2,34 @@ from aqt import mw
 from aqt.utils import qconnect
 from aqt.qt import *
 from aqt.webview import AnkiWebView
+from aqt.operations import QueryOp
+import hashlib
 import json
 import os
 import threading
-import pickle
-import datetime
+from contextlib import closing
 from .config import *
+from .words import *
+from .queries import *
+from .cache import *
+from .normalize import *
+from .timeline import *
 from .lib.gviz import gviz_api
 
 addon_directory = os.path.dirname(__file__)
 
-hsk_data = None
-hsk_tree = None
-freq_for_word = None
-freq_tree = None
+words_tree = None
+words_tree_version = None
+hsk_level_for_word_id = None
+num_stars_for_word_id = None
 def load_data():
-    global hsk_data
-    global hsk_tree
-    global freq_tree
-    global freq_for_word
-
-    hsk_file_path = os.path.join(addon_directory, 'hsk.json')
-    hsk_file = open(hsk_file_path, encoding='utf_8_sig')
-    hsk_data = json.load(hsk_file)
-
-    hsk_tree_file_path = os.path.join(addon_directory, 'hsk_tree.pickle')
-    hsk_tree_file = open(hsk_tree_file_path, 'rb')
-    hsk_tree = pickle.load(hsk_tree_file)
-    hsk_tree_file.close()
-
-    freq_file_path = os.path.join(addon_directory, 'freq.txt')
-    freq_file = open(freq_file_path, encoding='utf_8_sig')
-    freq_data = freq_file.read().splitlines()
-    freq_for_word = {k: v for v, k in enumerate(freq_data)}
-
-    freq_tree_file_path = os.path.join(addon_directory, 'freq_tree.pickle')
-    freq_tree_file = open(freq_tree_file_path, 'rb')
-    freq_tree = pickle.load(freq_tree_file)
-    freq_tree_file.close()
-
-def freq_num_stars(freq: int) -> int:
-    if freq <= 1500:
-        return 5
-    elif freq <= 5000:
-        return 4
-    elif freq <= 15000:
-        return 3
-    elif freq <= 30000:
-        return 2
-    elif freq <= 60000:
-        return 1
-    else:
-        return 0
+    global words_tree
+    global words_tree_version
+    global hsk_level_for_word_id
+    global num_stars_for_word_id
+    words_tree, words_tree_version = load_words_tree()
+    hsk_level_for_word_id = words_tree.payload_column(HSK_LEVEL)
+    num_stars_for_word_id = words_tree.payload_column(NUM_STARS)
 
 def num_words_for_stars(num_stars: int) -> int:
     return [ -1, 30000, 15000, 10000, 3500, 1500 ][num_stars]
@@ -61,111 +37,98 @@ def num_words_for_stars(num_stars: int) -> int:
 def num_words_in_hsk_level(hsk_level: int) -> int:
     return [ 150, 150, 300, 600, 1300, 2500 ][hsk_level - 1]
 
-def chinese_stats() -> None:
-    # Extract the sentences from the notes
+# How many notes are counted between progress reports and checks for
+# cancellation.
+PROGRESS_INTERVAL = 500
+# How often waiting for the words tree checks for cancellation, in seconds.
+CANCEL_CHECK_INTERVAL = 0.1
+
+def chinese_stats(col, report_progress=None, is_cancelled=None) -> None:
+    # Runs in the background, in a collection operation that passes col.
+    # report_progress(notes done, number of notes) is called every
+    # PROGRESS_INTERVAL notes, and None is returned as soon as
+    # is_cancelled() does.
+    #
+    # The notes stream through extraction of the search field, normalization,
+    # search and counting. Only the ids of the studied notes are read up
+    # front, their fields are read in batches as the search reaches them, so
+    # only the counts and the notes that words were first found in are kept.
     config = load_search_field_config()
-    sentence_note_ids = list()
-    sentence_for_note_id = dict()
+    search_field_ords = search_field_ords_from_config(config, col)
+    match_policy = load_match_policy()
+    cjk_only = load_cjk_only()
     note_info = {}
 
-    for note_id, model_id, deck_id, first_study_date in mw.col.db.execute("select nid, mid, did, min(revlog.id) as date from notes, cards, revlog where notes.id=cards.nid and cards.id=revlog.cid and cards.queue>0 group by notes.id order by date"):
-        search_field = selected_field_from_config(config, str(deck_id), str(model_id))
-        # Skip this note if the associated search field was not specified in the config.
-        if search_field is None:
-            continue
-        # Skip this note if the associated search field no longer exists in the note.
-        note = mw.col.getNote(note_id)
-        if search_field not in note:
-            continue
-        sentence_note_ids.append(note_id)
-        sentence_for_note_id[note_id] = note[search_field]
-        note_info[note_id] = first_study_date
-
-    # Wait on data loading to finish
-    load_data_thread.join()
-
-    # Search the sentences for HSK words
-    hsk_found_words = set()
+    # Only aggregate the revlog of the cards in the configured decks and models.
+    model_ids_for_deck = dict()
+    for deck_id, model_id in search_field_ords:
+        model_ids_for_deck.setdefault(deck_id, []).append(model_id)
+    studied_notes = col.db.execute(studied_notes_query(model_ids_for_deck)) if model_ids_for_deck else []
+    sentences = search_field_texts(col.db, studied_notes, search_field_ords)
+    num_notes = len(studied_notes)
+    if is_cancelled is not None and is_cancelled():
+        return None
+
+    # Wait on data loading to finish, the first start after an install or
+    # upgrade builds the words tree.
+    while load_data_thread.is_alive():
+        if is_cancelled is not None and is_cancelled():
+            return None
+        load_data_thread.join(CANCEL_CHECK_INTERVAL)
+
+    # Search the sentences for HSK words and words in the frequency list
+    found_words = set()
     hsk_results = dict()
     for hsk_level in range(1, 7):
         hsk_results.setdefault(str(hsk_level), [])
-
-    for note_id in sentence_note_ids:
-        sentence = sentence_for_note_id[note_id]
-        for word, _ in hsk_tree.search_all(sentence):
-            if word in hsk_found_words:
-                continue
-            hsk_level = hsk_data[word]
-            hsk_results[str(hsk_level)].append(note_id)
-            hsk_found_words.add(word)
-
-    # Search the sentences for words in the frequency list
-    freq_found_words = set()
     freq_results = dict()
     for num_stars in reversed(range(0, 6)):
         freq_results.setdefault(str(num_stars), [])
 
-    for note_id in sentence_note_ids:
-        sentence = sentence_for_note_id[note_id]
-        for word, _ in freq_tree.search_all(sentence):
-            if word in freq_found_words:
-                continue
-            freq = freq_for_word[word]
-            num_stars = freq_num_stars(freq)
-            freq_results[str(num_stars)].append(note_id)
-            freq_found_words.add(word)
-
-    return (note_info, hsk_results, freq_results)
-
-def to_day(time: datetime):
-    return datetime.datetime.strftime(time, '%Y-%m-%d')
-
-def to_datetime(time_str: str):
-    return datetime.datetime.strptime(time_str, '%Y-%m-%d')
-
-def results_by_day(note_info, results):
-    results_by_date = dict()
+    # Only the notes that changed since the stats were last opened are
+    # normalized and searched.
+    scan_key = '{}:{}:{}'.format(words_tree_version, NORMALIZE_VERSION, int(cjk_only))
+    def normalize(sentence):
+        return normalize_field(sentence, cjk_only)
+    os.makedirs(user_files_directory, exist_ok=True)
+    stats_cache_path = cache_path(user_files_directory, col.path)
+    scan_stats = ScanStats()
+    with StatsCache(stats_cache_path) as cache, closing(cached_search_ids(
+            cache, words_tree, scan_key, match_policy, sentences, normalize, scan_stats)) as searched_notes:
+        for note_index, (note_id, first_study_date, word_ids) in enumerate(searched_notes):
+            if note_index % PROGRESS_INTERVAL == 0:
+                if is_cancelled is not None and is_cancelled():
+                    return None
+                if report_progress is not None:
+                    report_progress(note_index, num_notes)
+            # Every word counts for the first note it was found in.
+            for word_id in word_ids:
+                if word_id in found_words:
+                    continue
+                found_words.add(word_id)
+                note_info[note_id] = first_study_date
+                hsk_level = hsk_level_for_word_id[word_id]
+                num_stars = num_stars_for_word_id[word_id]
+                if hsk_level != NOT_IN_HSK:
+                    hsk_results[str(hsk_level)].append(note_id)
+                if num_stars != NOT_IN_FREQ_LIST:
+                    freq_results[str(num_stars)].append(note_id)
+
+    return (note_info, hsk_results, freq_results, scan_stats)
+
+# Long timelines are sent to the page in chunks of this many days, so
+# the page draws what it has while the rest is still being sent.
+ROWS_PER_CHUNK = 1000
+
+def chart_json_chunks(note_info, results, column_name_func, rollover_hour):
+    days_for_key = dict()
     for key, note_ids in results.items():
-        for note_id in note_ids:
-            created_epoch = int(note_info[note_id]) / 1000.0
-            time_note_created = datetime.datetime.fromtimestamp(created_epoch)
-            date_note_created_str = to_day(time_note_created)
-
-            if not date_note_created_str in results_by_date:
-                results_by_date[date_note_created_str] = dict()
-
-            if not key in results_by_date[date_note_created_str]:
-                results_by_date[date_note_created_str][key] = 0
-
-            results_by_date[date_note_created_str][key] += 1
-    return results_by_date
-    
-def cumulative_results_by_day(note_info, results):
-    results_by_date = results_by_day(note_info, results)
-    cumulative_results = dict()
-    running_total = dict.fromkeys(results.keys(), 0)
-    for date_str in sorted(results_by_date):
-        results = results_by_date[date_str]
-        for key, num_words_created in results.items():
-            running_total[key] += num_words_created
-        cumulative_results[date_str] = dict(running_total)
-    return cumulative_results
-
-def chart_json(note_info, results, column_name_func):
-    cumulative_daily_results = cumulative_results_by_day(note_info, results)
+        days_for_key[key] = days_for_times((note_info[note_id] for note_id in note_ids), rollover_hour)
+    days, cumulative_counts = cumulative_counts_by_day(days_for_key)
 
     column_ids = dict()
     for key in results.keys():
         column_ids[key] = "col{}".format(key)
-            
-    # Generate per-day chart data
-    data = []
-    for date_str, cum_results in cumulative_daily_results.items():
-        row = { "date": to_datetime(date_str) }
-        for key, num_words_created in cum_results.items():
-            column_id = column_ids[key]
-            row[column_id] = num_words_created
-        data.append(row)
 
     description = {
         "date": ("date", "Date")
@@ -173,83 +136,226 @@ def chart_json(note_info, results, column_name_func):
     for key in column_ids:
         column_id = column_ids[key]
         description[column_id] = ("number", column_name_func(key))
-            
-    data_table = gviz_api.DataTable(description)
-    data_table.LoadData(data)
-    return data_table.ToJSon(
-        columns_order=tuple(["date"]) + tuple(column_ids.values()),
-        order_by="date"
-    )
 
-class MyWebView(AnkiWebView):
-    def __init__(self):
-        AnkiWebView.__init__(self, None)
-        page_template = """
-        <html>
-        <script src="https://www.gstatic.com/charts/loader.js"></script>
-        <script>
-            google.charts.load('current', {packages:['corechart']});
-            google.charts.setOnLoadCallback(drawCharts);
-
-            function drawHskChart() {
-                var options = {
-                    isStacked: true,
-                    focusTarget: 'category',
-                    title: 'Known Words by HSK Level',
-                    hAxis: {title: 'Date',  titleTextStyle: {color: '#333'}},
-                    vAxis: {minValue: 0}
-                };
-                var chart = new google.visualization.AreaChart(document.getElementById('hsk_chart'));
-                var data = new google.visualization.DataTable(%s, 0.6);
-                chart.draw(data, options);
-            }
+    # Every chunk is a table of its own, with the same columns and dates
+    # written as the number of days since the first day of the chart.
+    date_epoch = date_for_day(days[0]) if days else epoch_date
+    for start in range(0, max(len(days), 1), ROWS_PER_CHUNK):
+        end = start + ROWS_PER_CHUNK
+        # Generate per-day chart data, a column of dates and one of counts per key
+        columns = { "date": [date_for_day(day) for day in days[start:end]] }
+        for key, counts in cumulative_counts.items():
+            columns[column_ids[key]] = counts[start:end]
+
+        data_table = gviz_api.DataTable(description)
+        data_table.LoadColumns(columns)
+        yield data_table.ToCompactJSon(
+            columns_order=tuple(["date"]) + tuple(column_ids.values()),
+            order_by="date",
+            date_epoch=date_epoch
+        )
+
+def scan_summary(scan_stats: ScanStats) -> str:
+    return (
+        "Searched {} of {} notes: {} were unchanged since the stats were last opened, "
+        "{} had the same text as an earlier note ({} characters not searched again)."
+    ).format(scan_stats.num_searched, scan_stats.num_notes, scan_stats.num_cached,
+             scan_stats.num_duplicates, scan_stats.num_duplicate_chars)
+
+# The charts are drawn with Chart.js, bundled in web/chartjs and served to
+# the page by Anki. A hash of the file is in the URL, so the webview can
+# cache it and an upgraded add-on never gets a cached copy of an old one.
+CHARTS_SCRIPT = "web/chartjs/chart.umd.js"
+mw.addonManager.setWebExports(__name__, r"web/.*\.js")
+with open(os.path.join(addon_directory, CHARTS_SCRIPT), "rb") as charts_script_file:
+    charts_script_hash = hashlib.sha256(charts_script_file.read()).hexdigest()[:16]
+charts_script_url = "/_addons/{}/{}?v={}".format(
+    mw.addonManager.addonFromModule(__name__), CHARTS_SCRIPT, charts_script_hash)
+
+# The page is shown right away, it asks for the chart data once it is
+# loaded and draws every chart as its data arrives.
+page_template = """
+<script src="%s"></script>
+<H1>Chinese Stats</H1>
+<div id="progress_section">
+    <p id="status">Reading the reviews…</p>
+    <progress id="progress" style="width: 100%%"></progress>
+    <p><button onclick="pycmd('cancel')">Cancel</button></p>
+</div>
+<div style="position: relative; height: 500px; width: 100%%"><canvas id="hsk_chart"></canvas></div>
+<div style="position: relative; height: 500px; width: 100%%"><canvas id="freq_chart"></canvas></div>
+<p id="summary" style="color: gray"></p>
+<script>
+    var chartTitles = {
+        hsk_chart: 'Known Words by HSK Level',
+        freq_chart: 'Known Words by Frequency Rating'
+    };
+    var chartColors = ['#3366cc', '#dc3912', '#ff9900', '#109618', '#990099', '#0099c6', '#dd4477', '#66aa00'];
+    // The chart of every element that has received data, by its id.
+    var charts = {};
+
+    function setProgress(numNotesDone, numNotes) {
+        document.getElementById('status').textContent = 'Searching note ' + numNotesDone + ' of ' + numNotes + '…';
+        var progress = document.getElementById('progress');
+        progress.max = numNotes;
+        progress.value = numNotesDone;
+    }
 
-            function drawFreqChart() {
-                var options = {
-                    isStacked: true,
-                    focusTarget: 'category',
-                    title: 'Known Words by Frequency Rating',
-                    hAxis: {title: 'Date',  titleTextStyle: {color: '#333'}},
-                    vAxis: {minValue: 0}
-                };
-                var chart = new google.visualization.AreaChart(document.getElementById('freq_chart'));
-                var data = new google.visualization.DataTable(%s, 0.6);
-                chart.draw(data, options);
-            }
+    function setStatus(status) {
+        document.getElementById('status').textContent = status;
+    }
 
-            function drawCharts() {
-                drawHskChart();
-                drawFreqChart();
+    // The x axis is the number of days since the dateEpoch of the data.
+    function dayLabel(dateEpoch, day, options) {
+        return new Date(dateEpoch[0], dateEpoch[1], dateEpoch[2] + day).toLocaleDateString(undefined, options);
+    }
+
+    // A stacked area chart with a dataset for every column after the date,
+    // the first one at the bottom.
+    function createChart(chartId, compact) {
+        var dateEpoch = compact.dateEpoch;
+        var datasets = compact.cols.slice(1).map(function(col, i) {
+            var color = chartColors[i %% chartColors.length];
+            return {
+                label: col.label,
+                data: [],
+                fill: i === 0 ? 'origin' : '-1',
+                borderColor: color,
+                backgroundColor: color + '80',
+                borderWidth: 1,
+                pointRadius: 0
+            };
+        });
+        return new Chart(document.getElementById(chartId), {
+            type: 'line',
+            data: {datasets: datasets},
+            options: {
+                animation: false,
+                maintainAspectRatio: false,
+                interaction: {mode: 'index', intersect: false},
+                scales: {
+                    x: {
+                        type: 'linear',
+                        ticks: {
+                            callback: function(day) {
+                                return dayLabel(dateEpoch, day, {year: 'numeric', month: 'short'});
+                            }
+                        }
+                    },
+                    y: {stacked: true, beginAtZero: true}
+                },
+                plugins: {
+                    title: {display: true, text: chartTitles[chartId]},
+                    legend: {position: 'right', reverse: true},
+                    tooltip: {
+                        callbacks: {
+                            title: function(items) {
+                                return dayLabel(dateEpoch, items[0].parsed.x);
+                            }
+                        }
+                    }
+                }
             }
+        });
+    }
 
-            $(window).resize(function() {
-                drawCharts()
+    // Called with every chunk of a chart's data, the first one creates the
+    // chart and every chunk adds its rows. The chart is updated at most once
+    // per frame, however many chunks arrive.
+    function addChartData(chartId, compact) {
+        var chart = charts[chartId];
+        if (chart === undefined) {
+            chart = charts[chartId] = createChart(chartId, compact);
+        }
+        chart.data.datasets.forEach(function(dataset, i) {
+            compact.rows.forEach(function(row) {
+                dataset.data.push({x: row[0], y: row[i + 1]});
+            });
+        });
+        if (!chart.updatePending) {
+            chart.updatePending = true;
+            requestAnimationFrame(function() {
+                chart.updatePending = false;
+                chart.update('none');
             });
-        </script>
-        <body>
-            <H1>Chinese Stats</H1>
-            <div id="hsk_chart" style="height: 500px; width: 100%%"></div>
-            <div id="freq_chart" style="height: 500px; width: 100%%"></div>
-        </body>
-        </html>
-        """
-
-        # Create the chart data
-        note_info, hsk_results, freq_results = chinese_stats()
+        }
+    }
+
+    function finishCharts(summary) {
+        document.getElementById('progress_section').style.display = 'none';
+        document.getElementById('summary').textContent = summary;
+    }
+
+    pycmd('data');
+</script>
+"""
+
+class MyWebView(AnkiWebView):
+    def __init__(self):
+        AnkiWebView.__init__(self, None)
+        self.cancelled = threading.Event()
+        self.data_requested = False
+        self.set_bridge_command(self.on_bridge_cmd, self)
+        self.stdHtml(page_template % charts_script_url)
+
+    def send_chart_data(self, col):
+        # Runs in the background. The HSK chart has fewer words, so it is
+        # created and sent before the frequency chart.
+        stats = chinese_stats(col, self.report_progress, self.cancelled.is_set)
+        if stats is None:
+            return None
+        note_info, hsk_results, freq_results, scan_stats = stats
+        self.run_js_on_main("setStatus('Drawing the charts…')")
+        # The hour of the day at which Anki starts a new day.
+        rollover_hour = col.get_config('rollover', 4)
 
         def hsk_column_name(column_id):
             return "HSK {}".format(column_id)
-        hsk_json = chart_json(note_info, hsk_results, hsk_column_name)
+        for chunk in chart_json_chunks(note_info, hsk_results, hsk_column_name, rollover_hour):
+            if self.cancelled.is_set():
+                return None
+            self.run_js_on_main("addChartData('hsk_chart', {})".format(chunk))
 
         def freq_column_name(column_id):
             num_stars = int(column_id)
             num_hollow_stars = 5 - num_stars
             return num_stars * '★' + "☆" * num_hollow_stars
-        freq_json = chart_json(note_info, freq_results, freq_column_name)
-
-        # Inject it into the template
-        html = page_template % (hsk_json, freq_json)
-        self.stdHtml(html)
+        for chunk in chart_json_chunks(note_info, freq_results, freq_column_name, rollover_hour):
+            if self.cancelled.is_set():
+                return None
+            self.run_js_on_main("addChartData('freq_chart', {})".format(chunk))
+        return scan_summary(scan_stats)
+
+    def report_progress(self, num_notes_done, num_notes):
+        self.run_js_on_main("setProgress({}, {})".format(num_notes_done, num_notes))
+
+    def run_js_on_main(self, js):
+        # Called in the background, the page can only be updated on the main thread.
+        mw.taskman.run_on_main(lambda: self.run_js(js))
+
+    def run_js(self, js):
+        if not self.cancelled.is_set():
+            self.eval(js)
+
+    def on_chart_data_sent(self, summary):
+        if summary is not None:
+            self.run_js("finishCharts({})".format(json.dumps(summary)))
+
+    def on_bridge_cmd(self, cmd):
+        if cmd == 'data':
+            # Create the chart data in the background, so Anki stays
+            # responsive. As a collection operation, so the collection
+            # can't be closed under it by a sync or a profile switch.
+            if not self.data_requested:
+                self.data_requested = True
+                QueryOp(parent=self, op=self.send_chart_data, success=self.on_chart_data_sent).run_in_background()
+        elif cmd == 'cancel':
+            self.close()
+
+    def closeEvent(self, event):
+        # Stop creating the stats when the window is closed before they are done.
+        self.cancelled.set()
+        AnkiWebView.closeEvent(self, event)
 
 def show_webview():
     webview = MyWebView()
@@ -261,6 +367,7 @@ stats_action = QAction("Chinese Stats", mw)
 qconnect(stats_action.triggered, show_webview)
 mw.form.menuTools.addAction(stats_action)
 
-# Kick off loading the data since it takes a couple seconds.
+# Kick off loading the data, the first start after an install or upgrade
+# builds the words tree, which takes a couple seconds.
 load_data_thread = threading.Thread(target=load_data)
 load_data_thread.start()
\ No newline at end of file
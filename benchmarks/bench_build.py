@@ -0,0 +1,112 @@
+# Benchmark of building keyword trees for word lists from the size of the
+# HSK list (5k) up to 1M entries.
+#
+# Lists larger than freq.txt are padded with two-word compounds of frequent
+# words. With --baseline the depth first construction that copied the
+# transitions of every suffix into its state is timed as well, for lists up
+# to the size of freq.txt.
+#
+# Usage: python benchmarks/bench_build.py [--sizes 5000,99121,...] [--baseline]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from corpus import load_freq_words
+from ahocorapy.keywordtree import KeywordTree, CompactKeywordTree
+
+def word_list(freq_words, size, seed=0):
+    if size <= len(freq_words):
+        return freq_words[:size]
+    rng = random.Random(seed)
+    words = list(freq_words)
+    seen = set(words)
+    frequent_words = freq_words[:20000]
+    while len(words) < size:
+        word = rng.choice(frequent_words) + rng.choice(frequent_words)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def search_lss(kwtree, state):
+    # finalize() before it was breadth first.
+    zero_state = kwtree._zero_state
+    traversed = state.parent.longest_strict_suffix
+    while True:
+        if state.symbol in traversed.transitions and \
+                traversed.transitions[state.symbol] is not state:
+            state.longest_strict_suffix = traversed.transitions[state.symbol]
+            break
+        elif traversed is zero_state:
+            state.longest_strict_suffix = zero_state
+            break
+        else:
+            traversed = traversed.longest_strict_suffix
+    suffix = state.longest_strict_suffix
+    if suffix is zero_state:
+        return
+    if suffix.longest_strict_suffix is None:
+        search_lss(kwtree, suffix)
+    for symbol, next_state in suffix.transitions.items():
+        if symbol not in state.transitions:
+            state.transitions[symbol] = next_state
+
+def finalize_copying_suffixes(kwtree):
+    zero_state = kwtree._zero_state
+    zero_state.longest_strict_suffix = zero_state
+    processed = set()
+    to_process = [zero_state]
+    while to_process:
+        state = to_process.pop()
+        processed.add(state.identifier)
+        for child in state.transitions.values():
+            if child.identifier not in processed:
+                search_lss(kwtree, child)
+                to_process.append(child)
+
+def add_all(words):
+    kwtree = KeywordTree(case_insensitive=True)
+    for word in words:
+        kwtree.add(word)
+    return kwtree
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='5000,99121,250000,500000,1000000')
+    parser.add_argument('--baseline', action='store_true')
+    args = parser.parse_args()
+
+    freq_words = load_freq_words()
+    tree_file_path = os.path.join(tempfile.mkdtemp(), 'bench_tree.kwt')
+    print('{:>8} {:>9} {:>8} {:>9} {:>8} {:>8} {:>9}'.format(
+        'words', 'states', 'add', 'finalize', 'save', 'load', 'baseline'))
+    for size in map(int, args.sizes.split(',')):
+        words = word_list(freq_words, size)
+
+        start = time.perf_counter()
+        kwtree = add_all(words)
+        added = time.perf_counter()
+        kwtree.finalize()
+        finalized = time.perf_counter()
+        kwtree.save(tree_file_path)
+        saved = time.perf_counter()
+        CompactKeywordTree.load(tree_file_path)
+        loaded = time.perf_counter()
+
+        baseline = ''
+        if args.baseline and size <= len(freq_words):
+            baseline_tree = add_all(words)
+            baseline_start = time.perf_counter()
+            finalize_copying_suffixes(baseline_tree)
+            baseline = '{:.3f}s'.format(time.perf_counter() - baseline_start)
+            del baseline_tree
+
+        print('{:>8} {:>9} {:>7.3f}s {:>8.3f}s {:>7.3f}s {:>7.3f}s {:>9}'.format(
+            size, kwtree._counter, added - start, finalized - added,
+            saved - finalized, loaded - saved, baseline))
+        del kwtree
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Benchmark of search_all over the frequency list on Chinese sentences.
+#
+# Compares walking the whole chain of longest strict suffixes after every
+# character with following the dictionary suffix links.
+#
+# Usage: python benchmarks/bench_search.py [--sentences N] [--corpus FILE]
+# FILE is a UTF-8 text file with one sentence per line. Without it, a corpus
+# is generated from the frequency list.
+import argparse
+
+from corpus import chinese_sentences, load_freq_words, load_sentences, timed
+from ahocorapy.keywordtree import KeywordTree
+
+def next_state(zero_state, current_state, symbol):
+    # The trie only has its own edges, a miss follows the longest strict
+    # suffixes like search_all.
+    state = current_state.transitions.get(symbol)
+    while state is None and current_state is not zero_state:
+        current_state = current_state.longest_strict_suffix
+        state = current_state.transitions.get(symbol)
+    return state or zero_state
+
+def search_all_walking_suffixes(kwtree, text):
+    # search_all before dictionary suffix links.
+    zero_state = kwtree._zero_state
+    current_state = zero_state
+    for idx, symbol in enumerate(text):
+        current_state = next_state(zero_state, current_state, symbol)
+        state = current_state
+        while state is not zero_state:
+            if state.success:
+                keyword = state.matched_keyword
+                yield (keyword, idx + 1 - len(keyword))
+            state = state.longest_strict_suffix
+
+def states_visited(kwtree, sentences):
+    # Number of states looked at while collecting the matches, walking the
+    # suffix chain versus following dictionary suffix links.
+    zero_state = kwtree._zero_state
+    suffix_walk = 0
+    dictionary_walk = 0
+    for sentence in sentences:
+        current_state = zero_state
+        for symbol in sentence:
+            current_state = next_state(zero_state, current_state, symbol)
+            state = current_state
+            while state is not zero_state:
+                suffix_walk += 1
+                state = state.longest_strict_suffix
+            state = current_state if current_state.success else current_state.dictionary_suffix
+            while state is not zero_state:
+                dictionary_walk += 1
+                state = state.dictionary_suffix
+    return suffix_walk, dictionary_walk
+
+def scan(search, sentences):
+    return sum(1 for sentence in sentences for _ in search(sentence))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sentences', type=int, default=20000)
+    parser.add_argument('--corpus')
+    args = parser.parse_args()
+
+    words = load_freq_words()
+    sentences = load_sentences(args.corpus) if args.corpus else chinese_sentences(words, args.sentences)
+    num_chars = sum(len(sentence) for sentence in sentences)
+
+    kwtree = KeywordTree(case_insensitive=True)
+    for word in words:
+        kwtree.add(word)
+    kwtree.finalize()
+    compact_tree = kwtree.compact()
+
+    print('{} sentences, {} chars, {} keywords'.format(len(sentences), num_chars, len(words)))
+
+    baseline, baseline_matches = timed(scan, lambda text: search_all_walking_suffixes(kwtree, text), sentences)
+    linked, linked_matches = timed(scan, kwtree.search_all, sentences)
+    compact, compact_matches = timed(scan, compact_tree.search_all, sentences)
+    assert baseline_matches == linked_matches == compact_matches
+
+    suffix_walk, dictionary_walk = states_visited(kwtree, sentences)
+    print('{} matches'.format(baseline_matches))
+    print('states visited per char: {:.2f} walking suffixes, {:.2f} following dictionary suffixes'.format(
+        suffix_walk / num_chars, dictionary_walk / num_chars))
+    print('suffix chain walk:        {:.3f}s'.format(baseline))
+    print('dictionary suffix links:  {:.3f}s ({:.2f}x)'.format(linked, baseline / linked))
+    print('compact tree:             {:.3f}s ({:.2f}x)'.format(compact, baseline / compact))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Benchmark of the query that collects the studied notes, on a synthetic
+# collection where only a few of the decks are configured to be searched.
+#
+# Compares aggregating the revlog of the whole collection and dropping the
+# unconfigured (deck, model) pairs afterwards with filtering them in SQL,
+# and reading the fields along with the studied notes with reading them in
+# batches while the notes are streamed to the search.
+#
+# Usage: python benchmarks/bench_stats_query.py [--notes N] [--decks N]
+#                                              [--configured-decks N]
+#                                              [--reviews-per-card N]
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tracemalloc
+
+from corpus import addon_directory, timed
+
+sys.path.insert(0, addon_directory)
+from queries import FIELD_SEPARATOR, search_field_texts, studied_notes_query
+
+UNFILTERED_QUERY = (
+    "select notes.id, notes.mid, cards.did, notes.flds, min(revlog.id) as date "
+    "from notes, cards, revlog "
+    "where notes.id=cards.nid and cards.id=revlog.cid and cards.queue>0 "
+    "group by notes.id order by date")
+
+def create_collection(num_notes, num_decks, reviews_per_card, seed=0):
+    # The tables and indexes the query touches, as Anki creates them.
+    rng = random.Random(seed)
+    db = sqlite3.connect(':memory:')
+    db.executescript("""
+        create table notes (id integer primary key, mid integer not null, flds text not null);
+        create table cards (id integer primary key, nid integer not null, did integer not null,
+                            queue integer not null, due integer not null);
+        create table revlog (id integer primary key, cid integer not null);
+        create index ix_cards_nid on cards (nid);
+        create index ix_cards_sched on cards (did, queue, due);
+        create index ix_revlog_cid on revlog (cid);
+    """)
+    start = 1500000000000
+    notes = []
+    cards = []
+    reviews = []
+    for note_id in range(1, num_notes + 1):
+        deck_id = rng.randrange(num_decks) + 1
+        model_id = deck_id % 3 + 1
+        notes.append((note_id, model_id, '我们\x1f爱北京' + '。' * rng.randrange(200)))
+        for card_ord in range(2):
+            card_id = note_id * 2 + card_ord
+            cards.append((card_id, note_id, deck_id, rng.choice([0, 1, 2, 2, 2]), 0))
+            for _ in range(reviews_per_card):
+                reviews.append((start + rng.randrange(10 ** 11), card_id))
+    reviews = list({review_id: card_id for review_id, card_id in reviews}.items())
+    db.executemany("insert into notes values (?, ?, ?)", notes)
+    db.executemany("insert into cards values (?, ?, ?, ?, ?)", cards)
+    db.executemany("insert into revlog values (?, ?)", reviews)
+    db.execute("analyze")
+    return db
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=50000)
+    parser.add_argument('--decks', type=int, default=40)
+    parser.add_argument('--configured-decks', type=int, default=2)
+    parser.add_argument('--reviews-per-card', type=int, default=10)
+    args = parser.parse_args()
+
+    db = create_collection(args.notes, args.decks, args.reviews_per_card)
+    model_ids_for_deck = {deck_id: {deck_id % 3 + 1} for deck_id in range(1, args.configured_decks + 1)}
+
+    def unfiltered():
+        return [row for row in db.execute(UNFILTERED_QUERY)
+                if row[1] in model_ids_for_deck.get(row[2], ())]
+
+    search_field_ords = {(deck_id, deck_id % 3 + 1): 1 for deck_id in range(1, args.configured_decks + 1)}
+
+    def filtered():
+        studied_notes = db.execute(studied_notes_query(model_ids_for_deck)).fetchall()
+        return [note_id for note_id, _, _ in search_field_texts(db, studied_notes, search_field_ords)]
+
+    def peak_memory(texts):
+        # Peak memory while the texts are consumed one at a time, as the
+        # search does.
+        tracemalloc.start()
+        for _ in texts():
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    def texts_with_fields():
+        # Anki's DBProxy returns all the rows at once.
+        rows = db.execute(UNFILTERED_QUERY).fetchall()
+        for note_id, model_id, deck_id, fields, first_review in rows:
+            if model_id in model_ids_for_deck.get(deck_id, ()):
+                yield note_id, fields.split(FIELD_SEPARATOR)[1], first_review
+
+    def texts_in_batches():
+        studied_notes = db.execute(studied_notes_query(model_ids_for_deck)).fetchall()
+        return search_field_texts(db, studied_notes, search_field_ords)
+
+    num_reviews = db.execute("select count() from revlog").fetchone()[0]
+    print('{} notes, {} reviews, {} of {} decks configured'.format(
+        args.notes, num_reviews, args.configured_decks, args.decks))
+    unfiltered_time, unfiltered_rows = timed(unfiltered)
+    filtered_time, filtered_rows = timed(filtered)
+    assert filtered_rows == [row[0] for row in unfiltered_rows]
+    print('filter in python: {:.3f}s, {} notes'.format(unfiltered_time, len(unfiltered_rows)))
+    print('filter in sql:    {:.3f}s, {} notes ({:.1f}x)'.format(
+        filtered_time, len(filtered_rows), unfiltered_time / filtered_time))
+    for row in db.execute("explain query plan " + studied_notes_query(model_ids_for_deck)):
+        print('  plan:', row[-1])
+    print('peak memory, fields with the notes: {:.1f}MB'.format(peak_memory(texts_with_fields) / 1e6))
+    print('peak memory, fields in batches:     {:.1f}MB'.format(peak_memory(texts_in_batches) / 1e6))
+
+if __name__ == '__main__':
+    main()
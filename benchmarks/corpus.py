@@ -0,0 +1,39 @@
+import itertools
+import os
+import random
+import sys
+import time
+
+addon_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(addon_directory, 'lib'))
+
+def load_freq_words():
+    freq_file_path = os.path.join(addon_directory, 'freq.txt')
+    with open(freq_file_path, encoding='utf_8_sig') as freq_file:
+        return freq_file.read().splitlines()
+
+def load_sentences(path):
+    with open(path, encoding='utf_8_sig') as corpus_file:
+        return [line.strip() for line in corpus_file if line.strip()]
+
+def chinese_sentences(words, count, seed=0):
+    # Sentences of words drawn with Zipf weights from the frequency ranked
+    # list, which matches how often words show up in real Chinese text.
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+    sentences = []
+    for _ in range(count):
+        num_words = rng.randint(4, 16)
+        sentence_words = rng.choices(words, cum_weights=cum_weights, k=num_words)
+        comma = rng.randint(1, num_words - 1)
+        sentences.append(''.join(sentence_words[:comma]) + '，' + ''.join(sentence_words[comma:]) + '。')
+    return sentences
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+from array import array
+from collections import deque
+from dataclasses import dataclass
+
+# Persistent cache of what the stats derive from a collection, so reopening
+# the stats only looks at what changed since the last time. There is one
+# cache database per collection, in the user_files directory.
+
+# Bump when the tables of the cache change, the cache is then recreated.
+CACHE_SCHEMA_VERSION = 3
+
+CACHE_SCHEMA = """
+    create table meta (key text primary key, value not null);
+    create table note_words (nid integer primary key, checksum integer not null, word_ids blob not null);
+"""
+
+# How long opening the cache waits for another stats window to finish with it.
+CACHE_LOCK_TIMEOUT = 0.5
+
+def cache_path(directory: str, collection_path: str) -> str:
+    key = hashlib.sha256(collection_path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(directory, 'stats_cache-{}.db'.format(key))
+
+class StatsCache:
+    # The stats never fail because of the cache. A damaged cache file is
+    # deleted and created again. A cache that is locked by another stats
+    # window, or can't be opened at all, is replaced by an empty one in
+    # memory, so the stats are just not cached this time.
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            self.db = self._open(path)
+        except sqlite3.OperationalError:
+            self.db = self._open(':memory:')
+        except sqlite3.DatabaseError:
+            try:
+                os.remove(path)
+                self.db = self._open(path)
+            except (OSError, sqlite3.DatabaseError):
+                self.db = self._open(':memory:')
+
+    @staticmethod
+    def _open(path: str):
+        db = sqlite3.connect(path, timeout=CACHE_LOCK_TIMEOUT)
+        try:
+            # Holds the write lock until the first commit, so the writes
+            # of the stats can't fail on a lock later.
+            db.execute("begin immediate")
+            schema_version = db.execute("pragma user_version").fetchone()[0]
+            if schema_version != CACHE_SCHEMA_VERSION:
+                tables = [row[0] for row in db.execute("select name from sqlite_master where type='table'")]
+                for table in tables:
+                    db.execute("drop table {}".format(table))
+                for statement in CACHE_SCHEMA.split(';'):
+                    db.execute(statement)
+                db.execute("pragma user_version={}".format(CACHE_SCHEMA_VERSION))
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+    def get(self, key: str, default=None):
+        for (value,) in self.db.execute("select value from meta where key=?", (key,)):
+            return value
+        return default
+
+    def set(self, key: str, value) -> None:
+        self.db.execute("insert or replace into meta values (?, ?)", (key, value))
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def text_checksum(text: str) -> int:
+    # 64 bits, signed to fit in an sqlite integer.
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+@dataclass
+class ScanStats():
+    # What cached_search_ids did with the notes.
+    num_notes: int = 0
+    num_cached: int = 0
+    num_searched: int = 0
+    # Notes whose normalized text was already searched for another note.
+    num_duplicates: int = 0
+    num_duplicate_chars: int = 0
+
+def cached_search_ids(cache: StatsCache, words_tree, scan_key: str, policy: str, notes, normalize=None,
+                      scan_stats: ScanStats = None):
+    # For each of the notes, (note id, text, info), yields (note id, info,
+    # ids of the distinct words found in the text), like words_tree.search_ids
+    # without seen. The ids are arrays: unlike sets they are not tracked by
+    # the garbage collector. info is passed through, for the caller.
+    # The word ids found in every note are cached with a checksum of its
+    # text, so only the notes which are new or whose text changed since the
+    # last time are searched, and only their text is passed through
+    # normalize before the search. The notes are consumed one at a time.
+    # Notes with the same normalized text are searched once, the caller
+    # credits the words to the first of them.
+    # scan_key identifies the words tree and the normalization, it is stored
+    # with the match policy and the cached word ids are dropped when either
+    # changes.
+    scan_key = '{}:{}'.format(scan_key, policy)
+    if cache.get('note_words_key') != scan_key:
+        cache.db.execute("delete from note_words")
+        cache.set('note_words_key', scan_key)
+    # Two flat dicts rather than one of tuples, the tuples would all outlive
+    # the loop and make the garbage collector run over and over.
+    cached_checksums = dict(cache.db.execute("select nid, checksum from note_words"))
+    cached_word_ids = dict(cache.db.execute("select nid, word_ids from note_words"))
+
+    if scan_stats is None:
+        scan_stats = ScanStats()
+    # Word ids by checksum of the normalized texts searched so far.
+    word_ids_for_text = dict()
+    # The texts to search go through a single search_ids call, fed one text
+    # at a time as the notes come in: search_ids only takes the next text
+    # when it is asked for the next result.
+    texts_to_search = deque()
+    found_word_ids = words_tree.search_ids(iter(texts_to_search.popleft, None), policy=policy)
+    updated_words = []
+    try:
+        for note_id, text, info in notes:
+            scan_stats.num_notes += 1
+            checksum = text_checksum(text)
+            if cached_checksums.pop(note_id, None) == checksum:
+                scan_stats.num_cached += 1
+                yield note_id, info, array('i', cached_word_ids.pop(note_id))
+                continue
+            if normalize is not None:
+                text = normalize(text)
+            text_key = text_checksum(text)
+            word_ids = word_ids_for_text.get(text_key)
+            if word_ids is not None:
+                scan_stats.num_duplicates += 1
+                scan_stats.num_duplicate_chars += len(text)
+            else:
+                scan_stats.num_searched += 1
+                texts_to_search.append(text)
+                word_ids = array('i', sorted(next(found_word_ids)))
+                word_ids_for_text[text_key] = word_ids
+            updated_words.append((note_id, checksum, word_ids.tobytes()))
+            yield note_id, info, word_ids
+        # What is left are notes that were deleted or are no longer searched.
+        # Only known once all the notes were seen.
+        cache.db.executemany("delete from note_words where nid=?", ((note_id,) for note_id in cached_checksums))
+    finally:
+        found_word_ids.close()
+        # Also keep what was searched when the caller stops early.
+        cache.db.executemany("insert or replace into note_words values (?, ?, ?)", updated_words)
+        cache.db.commit()
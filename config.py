@@ -5,10 +5,13 @@ from aqt.utils import tooltip
 from aqt.qt import *
 from typing import Optional
 from typing import List
+from typing import Dict
+from typing import Tuple
 from dataclasses import dataclass
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'lib'))
 from dacite import from_dict
+from .lib.ahocorapy.keywordtree import OVERLAPPING, LEFTMOST_LONGEST, RIGHTMOST_LONGEST
 
 @dataclass
 class SearchFieldConfigModel():
@@ -24,12 +27,22 @@ class SearchFieldConfigDeck():
 class SearchFieldConfig():
     decks: List[SearchFieldConfigDeck]
 
-def selected_field_from_config(config: SearchFieldConfig, deck_id: str, model_id: str) -> Optional[str]:
+# Maps (deck id, model id) to the position of the selected field in the notes of the model.
+SearchFieldOrds = Dict[Tuple[int, int], int]
+
+def search_field_ords_from_config(config: SearchFieldConfig, col) -> SearchFieldOrds:
+    # Compile the config once, so looking up the field of a note is a single dict lookup.
+    # Fields that no longer exist in their model are left out.
+    search_field_ords: SearchFieldOrds = dict()
     for deck in config.decks:
-        if deck.id == deck_id:
-            for model in deck.models:
-                if model.id == model_id:
-                    return model.selected_field    
+        for model in deck.models:
+            note_type = col.models.get(int(model.id))
+            if note_type is None:
+                continue
+            for field in note_type['flds']:
+                if field['name'] == model.selected_field:
+                    search_field_ords[(int(deck.id), int(model.id))] = field['ord']
+    return search_field_ords
 
 @dataclass
 class SearchFieldConfigModelViewModel:
@@ -48,8 +61,9 @@ class SearchFieldConfigDeckViewModel:
 class SearchFieldConfigViewModel:
     decks: List[SearchFieldConfigDeckViewModel]
 
-def search_fields_config_view_model(config: SearchFieldConfigModel) -> SearchFieldConfigViewModel:
+def search_fields_config_view_model(config: SearchFieldConfig) -> SearchFieldConfigViewModel:
     decks: List[SearchFieldConfigDeckViewModel] = []
+    search_field_ords = search_field_ords_from_config(config, mw.col)
 
     for row in mw.col.db.execute('select group_concat(distinct notes.mid), cards.did from notes, cards where notes.id=cards.nid group by cards.did'):
         model_ids = row[0].split(',')
@@ -64,7 +78,8 @@ def search_fields_config_view_model(config: SearchFieldConfigModel) -> SearchFie
             for field in model['flds']:
                 fields.append(field['name'])
 
-            selected_field = selected_field_from_config(config, deck_id, model_id)
+            selected_field_ord = search_field_ords.get((int(deck_id), int(model_id)))
+            selected_field = None if selected_field_ord is None else fields[selected_field_ord]
             models.append(SearchFieldConfigModelViewModel(model_name, model_id, fields, selected_field))
     
         deck_name = mw.col.decks.get(deck_id)['name']
@@ -90,12 +105,46 @@ def load_search_field_config() -> SearchFieldConfig:
     return SearchFieldConfig([])
 
 def save_search_field_config(search_fields_config: SearchFieldConfig):
+    config = mw.addonManager.getConfig(__name__) or {}
     if search_fields_config.decks:
-        config = {
-            'search_fields': dataclasses.asdict(search_fields_config)
-        }
+        config['search_fields'] = dataclasses.asdict(search_fields_config)
     else: 
-        config = {}
+        config.pop('search_fields', None)
+    mw.addonManager.writeConfig(__name__, config)
+    tooltip("Config saved.")
+
+# How words are counted, see the match policies in ahocorapy.keywordtree.
+match_policy_names = {
+    OVERLAPPING: 'Every word, including words inside longer words',
+    LEFTMOST_LONGEST: 'Longest words, reading left to right',
+    RIGHTMOST_LONGEST: 'Longest words, reading right to left',
+}
+
+def load_match_policy() -> str:
+    config = mw.addonManager.getConfig(__name__) or {}
+    match_policy = config.get('match_policy', OVERLAPPING)
+    if match_policy not in match_policy_names:
+        return OVERLAPPING
+    return match_policy
+
+def save_match_policy(match_policy: str):
+    config = mw.addonManager.getConfig(__name__) or {}
+    config['match_policy'] = match_policy
+    mw.addonManager.writeConfig(__name__, config)
+    tooltip("Config saved.")
+
+def match_policy_changed(match_policy_name):
+    for match_policy, name in match_policy_names.items():
+        if name == match_policy_name:
+            save_match_policy(match_policy)
+
+def load_cjk_only() -> bool:
+    config = mw.addonManager.getConfig(__name__) or {}
+    return bool(config.get('cjk_only', False))
+
+def save_cjk_only(cjk_only: bool):
+    config = mw.addonManager.getConfig(__name__) or {}
+    config['cjk_only'] = cjk_only
     mw.addonManager.writeConfig(__name__, config)
     tooltip("Config saved.")
 
@@ -129,6 +178,20 @@ def show_settings():
     main_layout = QVBoxLayout(dialog)
     main_layout.addWidget(scroll_area)
     
+    match_policy_label = QLabel('Choose which words in a field are counted.')
+    layout.addWidget(match_policy_label)
+    match_policy_selector = QComboBox()
+    match_policy_selector.wheelEvent = lambda event: None
+    match_policy_selector.addItems(match_policy_names.values())
+    match_policy_selector.setCurrentText(match_policy_names[load_match_policy()])
+    match_policy_selector.currentTextChanged.connect(match_policy_changed)
+    layout.addWidget(match_policy_selector)
+    cjk_only_checkbox = QCheckBox('Only search Chinese characters, skipping words like 卡拉OK')
+    cjk_only_checkbox.setChecked(load_cjk_only())
+    cjk_only_checkbox.toggled.connect(save_cjk_only)
+    layout.addWidget(cjk_only_checkbox)
+    layout.addSpacing(8)
+
     field_search_setting_label = QLabel('Choose which field to search within each deck and note type.')
     layout.addWidget(field_search_setting_label)
     layout.addSpacing(8)
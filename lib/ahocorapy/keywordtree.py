@@ -10,12 +10,29 @@ Created on Jan 5, 2016
 @author: Frederik Petersen (fp@abusix.com)
 '''
 
+from array import array
+from bisect import bisect_left
 from builtins import object
+from collections import deque
+import mmap
+import struct
+
+# Matching policies of search_words and search_ids.
+# OVERLAPPING reports every occurence of every keyword, like search_all.
+# LEFTMOST_LONGEST segments the text into non-overlapping keywords from the
+# left, taking the longest keyword at each position (forward maximum
+# matching). RIGHTMOST_LONGEST does the same from the right (backward
+# maximum matching). Characters not covered by a keyword are skipped.
+OVERLAPPING = 'overlapping'
+LEFTMOST_LONGEST = 'leftmost_longest'
+RIGHTMOST_LONGEST = 'rightmost_longest'
+MATCH_POLICIES = (OVERLAPPING, LEFTMOST_LONGEST, RIGHTMOST_LONGEST)
 
 
 class State(object):
     __slots__ = ['identifier', 'symbol', 'success', 'transitions', 'parent',
-                 'matched_keyword', 'longest_strict_suffix']
+                 'matched_keyword', 'keyword_id', 'payload',
+                 'longest_strict_suffix', 'dictionary_suffix']
 
     def __init__(self, identifier, symbol=None,  parent=None, success=False):
         self.symbol = symbol
@@ -24,7 +41,10 @@ class State(object):
         self.parent = parent
         self.success = success
         self.matched_keyword = None
+        self.keyword_id = None
+        self.payload = None
         self.longest_strict_suffix = None
+        self.dictionary_suffix = None
 
     def __str__(self):
         transitions_as_string = ','.join(
@@ -48,23 +68,34 @@ class KeywordTree(object):
         '''
         self._zero_state = State(0)
         self._counter = 1
+        self._num_keywords = 0
         self._finalized = False
         self._case_insensitive = case_insensitive
+        self._fail_children = None
+        self._states_for_symbol = None
 
-    def add(self, keyword):
+    def add(self, keyword, payload=None):
         '''
         Add a keyword to the tree.
-        Can only be used before finalize() has been called.
         Keyword should be str or unicode.
+        Keywords are numbered with ids in the order they are first added.
+        Keywords added after finalize() has been called are searchable
+        right away. Only the states whose suffixes change are relinked,
+        which is much cheaper than building the tree again.
+        @param payload: Optional record reported alongside the keyword by
+                        search_all_with_payloads(). Trees that are
+                        compacted need payloads to be tuples of ints of
+                        the same length. Compacted payloads are stored
+                        as bytes if all values are in range(256).
         '''
-        if self._finalized:
-            raise ValueError('KeywordTree has been finalized.' +
-                             ' No more keyword additions allowed')
         original_keyword = keyword
         if self._case_insensitive:
             keyword = keyword.lower()
         if len(keyword) <= 0:
             return
+        if self._finalized:
+            self._add_to_finalized(keyword, original_keyword, payload)
+            return
         current_state = self._zero_state
         for char in keyword:
             try:
@@ -75,8 +106,149 @@ class KeywordTree(object):
                 self._counter += 1
                 current_state.transitions[char] = next_state
                 current_state = next_state
+        if not current_state.success:
+            current_state.keyword_id = self._num_keywords
+            self._num_keywords += 1
+        current_state.success = True
+        current_state.matched_keyword = original_keyword
+        current_state.payload = payload
+
+    def _add_to_finalized(self, keyword, original_keyword, payload):
+        zero_state = self._zero_state
+        if self._fail_children is None:
+            self._fail_children = self._build_fail_children()
+            self._states_for_symbol = self._build_states_for_symbol()
+        fail_children = self._fail_children
+        states_for_symbol = self._states_for_symbol
+
+        current_state = zero_state
+        new_states = []
+        for char in keyword:
+            child = current_state.transitions.get(char)
+            if child is None:
+                child = State(self._counter, parent=current_state,
+                              symbol=char)
+                self._counter += 1
+                current_state.transitions[char] = child
+                new_states.append(child)
+                states_for_symbol.setdefault(char, []).append(child)
+            current_state = child
+        became_success = not current_state.success
+        if became_success:
+            current_state.keyword_id = self._num_keywords
+            self._num_keywords += 1
         current_state.success = True
         current_state.matched_keyword = original_keyword
+        current_state.payload = payload
+
+        # States whose dictionary suffix may have changed, together with
+        # everything below them in the failure tree.
+        dirty = list(new_states)
+        if became_success and not new_states:
+            dirty.append(current_state)
+
+        # New states are handled shallow to deep, so the suffixes they
+        # depend on are up to date.
+        for state in new_states:
+            parent = state.parent
+            symbol = state.symbol
+            suffix = self._longest_strict_suffix(parent, symbol)
+            state.longest_strict_suffix = suffix
+            fail_children[suffix].append(state)
+            fail_children[state] = []
+
+            # The new state is the longest strict suffix of every state
+            # reached with its symbol from a state that ends with its
+            # parent, unless that state already had a longer one. Only
+            # the states reached with the symbol are looked at, the
+            # failure subtree of the parent can be the whole tree.
+            depth = self._depth(state)
+            for child in states_for_symbol[symbol]:
+                old_suffix = child.longest_strict_suffix
+                # Deeper new states are linked in their own turn.
+                if child is state or old_suffix is None:
+                    continue
+                if not self._ends_with(child.parent, parent):
+                    continue
+                if self._depth(old_suffix) < depth:
+                    fail_children[old_suffix].remove(child)
+                    child.longest_strict_suffix = state
+                    fail_children[state].append(child)
+                    dirty.append(child)
+
+        # Recompute the dictionary suffixes, parents in the failure tree
+        # before their children.
+        relinked = set()
+        dirty.sort(key=self._depth)
+        for dirty_state in dirty:
+            if dirty_state in relinked:
+                continue
+            for state in self._fail_subtree(dirty_state):
+                if state in relinked:
+                    continue
+                relinked.add(state)
+                suffix = state.longest_strict_suffix
+                state.dictionary_suffix = suffix if suffix.success \
+                    else suffix.dictionary_suffix
+
+    def _build_fail_children(self):
+        '''
+        @return: Dict of every state to the states whose longest strict
+                 suffix it is.
+        '''
+        zero_state = self._zero_state
+        fail_children = {zero_state: []}
+        queue = deque([zero_state])
+        while queue:
+            state = queue.popleft()
+            for child in state.transitions.values():
+                fail_children[child] = []
+                queue.append(child)
+        for state in fail_children:
+            if state is not zero_state:
+                fail_children[state.longest_strict_suffix].append(state)
+        return fail_children
+
+    def _build_states_for_symbol(self):
+        '''
+        @return: Dict of every symbol to the states reached with it.
+        '''
+        states_for_symbol = {}
+        for state in self._fail_children:
+            if state is not self._zero_state:
+                states_for_symbol.setdefault(state.symbol, []).append(state)
+        return states_for_symbol
+
+    def _ends_with(self, state, suffix):
+        '''
+        @return: Whether suffix is the state or one of its suffixes.
+        '''
+        zero_state = self._zero_state
+        while state is not suffix:
+            if state is zero_state:
+                return False
+            state = state.longest_strict_suffix
+        return True
+
+    def _fail_subtree(self, state):
+        '''
+        @return: Generator of the state and all states below it in the
+                 failure tree, each after its longest strict suffix.
+        '''
+        fail_children = self._fail_children
+        todo_list = [state]
+        while todo_list:
+            state = todo_list.pop()
+            yield state
+            todo_list.extend(fail_children[state])
+
+    @staticmethod
+    def _depth(state):
+        depth = 0
+        while state.parent is not None:
+            depth += 1
+            state = state.parent
+        return depth
 
     def search(self, text):
         '''
@@ -115,60 +287,305 @@ class KeywordTree(object):
         zero_state = self._zero_state
         current_state = zero_state
         for idx, symbol in enumerate(text):
-            current_state = current_state.transitions.get(
-                symbol, zero_state.transitions.get(symbol, zero_state))
+            next_state = current_state.transitions.get(symbol)
+            while next_state is None and current_state is not zero_state:
+                current_state = current_state.longest_strict_suffix
+                next_state = current_state.transitions.get(symbol)
+            current_state = next_state or zero_state
+            state = current_state
+            if not state.success:
+                state = state.dictionary_suffix
+            while state is not zero_state:
+                keyword = state.matched_keyword
+                yield (keyword, idx + 1 - len(keyword))
+                state = state.dictionary_suffix
+
+    def search_all_with_payloads(self, text):
+        '''
+        Like search_all, but yields 3-Tuples of keyword, startindex and
+        the payload the keyword was added with.
+        '''
+        if not self._finalized:
+            raise ValueError('KeywordTree has not been finalized.' +
+                             ' No search allowed. Call finalize() first.')
+        if self._case_insensitive:
+            text = text.lower()
+        zero_state = self._zero_state
+        current_state = zero_state
+        for idx, symbol in enumerate(text):
+            next_state = current_state.transitions.get(symbol)
+            while next_state is None and current_state is not zero_state:
+                current_state = current_state.longest_strict_suffix
+                next_state = current_state.transitions.get(symbol)
+            current_state = next_state or zero_state
             state = current_state
+            if not state.success:
+                state = state.dictionary_suffix
             while state is not zero_state:
-                if state.success:
-                    keyword = state.matched_keyword
-                    yield (keyword, idx + 1 - len(keyword))
-                state = state.longest_strict_suffix
+                keyword = state.matched_keyword
+                yield (keyword, idx + 1 - len(keyword), state.payload)
+                state = state.dictionary_suffix
+
+    def search_words(self, text, policy=LEFTMOST_LONGEST):
+        '''
+        Segment a text into non-overlapping keywords.
+        Can only be called after finalized() has been called.
+        @param policy: LEFTMOST_LONGEST or RIGHTMOST_LONGEST.
+        @return: Generator of 2-Tuples with keyword and startindex in text,
+                 in text order.
+        '''
+        if not self._finalized:
+            raise ValueError('KeywordTree has not been finalized.' +
+                             ' No search allowed. Call finalize() first.')
+        if self._case_insensitive:
+            text = text.lower()
+        for state, start in self._segment(text, policy):
+            yield (state.matched_keyword, start)
+
+    def _segment(self, text, policy):
+        '''
+        @return: List of (state, startindex) of the keywords the policy
+                 segments the (already lowercased) text into.
+        '''
+        zero_state = self._zero_state
+        segments = []
+        if policy == LEFTMOST_LONGEST:
+            length = len(text)
+            start = 0
+            while start < length:
+                state = zero_state
+                longest = None
+                end = start
+                for idx in range(start, length):
+                    child = state.transitions.get(text[idx])
+                    if child is None:
+                        break
+                    state = child
+                    if state.success:
+                        longest = state
+                        end = idx + 1
+                if longest is None:
+                    start += 1
+                else:
+                    segments.append((longest, start))
+                    start = end
+        elif policy == RIGHTMOST_LONGEST:
+            # The longest keyword ending at each index is the first one
+            # search_all reports there.
+            longest_ending_at = []
+            current_state = zero_state
+            for symbol in text:
+                next_state = current_state.transitions.get(symbol)
+                while next_state is None and current_state is not zero_state:
+                    current_state = current_state.longest_strict_suffix
+                    next_state = current_state.transitions.get(symbol)
+                current_state = next_state or zero_state
+                longest_ending_at.append(
+                    current_state if current_state.success
+                    else current_state.dictionary_suffix)
+            end = len(text)
+            while end > 0:
+                state = longest_ending_at[end - 1]
+                if state is zero_state:
+                    end -= 1
+                else:
+                    end -= len(state.matched_keyword)
+                    segments.append((state, end))
+            segments.reverse()
+        else:
+            raise ValueError('Unknown match policy {0}.'.format(policy))
+        return segments
+
+    def search_ids(self, texts, seen=None, policy=OVERLAPPING):
+        '''
+        Batch search. Yields, for each of the texts, the set of ids of the
+        distinct keywords found in it.
+        Can only be called after finalized() has been called.
+        @param seen: Optional set of keyword ids to leave out. The reported
+                     ids are added to it, so every keyword is reported for
+                     the first text it occurs in only.
+        @param policy: One of MATCH_POLICIES. With LEFTMOST_LONGEST or
+                       RIGHTMOST_LONGEST only the keywords the text is
+                       segmented into are reported.
+        '''
+        if not self._finalized:
+            raise ValueError('KeywordTree has not been finalized.' +
+                             ' No search allowed. Call finalize() first.')
+        zero_state = self._zero_state
+        for text in texts:
+            if self._case_insensitive:
+                text = text.lower()
+            if policy != OVERLAPPING:
+                found = {state.keyword_id
+                         for state, _ in self._segment(text, policy)}
+                if seen is not None:
+                    found -= seen
+                    seen |= found
+                yield found
+                continue
+            # Once a state has been reported, so has its dictionary suffix
+            # chain, which lets the walk stop early.
+            found_states = set()
+            current_state = zero_state
+            for symbol in text:
+                next_state = current_state.transitions.get(symbol)
+                while next_state is None and current_state is not zero_state:
+                    current_state = current_state.longest_strict_suffix
+                    next_state = current_state.transitions.get(symbol)
+                current_state = next_state or zero_state
+                state = current_state
+                if not state.success:
+                    state = state.dictionary_suffix
+                while state is not zero_state and state not in found_states:
+                    found_states.add(state)
+                    state = state.dictionary_suffix
+            found = {state.keyword_id for state in found_states}
+            if seen is not None:
+                found -= seen
+                seen |= found
+            yield found
 
     def finalize(self):
         '''
         Needs to be called after all keywords have been added and
         before any searching is performed.
+        Links the states breadth first, in O(number of states) steps,
+        amortized over the failure links followed.
         '''
         if self._finalized:
             raise ValueError('KeywordTree has already been finalized.')
-        self._zero_state.longest_strict_suffix = self._zero_state
-        self.search_lss_for_children(self._zero_state)
+        zero_state = self._zero_state
+        zero_state.longest_strict_suffix = zero_state
+        zero_state.dictionary_suffix = zero_state
+        # Breadth first, a suffix is always shallower than its state, so
+        # it is linked before the state needs it.
+        queue = deque([zero_state])
+        while queue:
+            state = queue.popleft()
+            for symbol, child in state.transitions.items():
+                suffix = self._longest_strict_suffix(state, symbol)
+                child.longest_strict_suffix = suffix
+                child.dictionary_suffix = suffix if suffix.success \
+                    else suffix.dictionary_suffix
+                queue.append(child)
         self._finalized = True
 
-    def search_lss_for_children(self, zero_state):
-        processed = set()
-        to_process = [zero_state]
-        while to_process:
-            state = to_process.pop()
-            processed.add(state.identifier)
-            for child in state.transitions.values():
-                if child.identifier not in processed:
-                    self.search_lss(child)
-                    to_process.append(child)
-
-    def search_lss(self, state):
+    def _longest_strict_suffix(self, parent, symbol):
+        '''
+        @return: The longest strict suffix of the child of parent reached
+                 with symbol. The suffixes of parent must be linked.
+        '''
         zero_state = self._zero_state
-        parent = state.parent
+        if parent is zero_state:
+            return zero_state
         traversed = parent.longest_strict_suffix
         while True:
-            if state.symbol in traversed.transitions and\
-                    traversed.transitions[state.symbol] is not state:
-                state.longest_strict_suffix =\
-                    traversed.transitions[state.symbol]
-                break
-            elif traversed is zero_state:
-                state.longest_strict_suffix = zero_state
+            suffix = traversed.transitions.get(symbol)
+            if suffix is not None:
+                return suffix
+            if traversed is zero_state:
+                return zero_state
+            traversed = traversed.longest_strict_suffix
+
+    def link_dictionary_suffixes(self):
+        '''
+        Point every state at the closest state in its chain of longest
+        strict suffixes that completes a keyword (or the zero state),
+        so that searching only visits states that emit a match.
+        '''
+        zero_state = self._zero_state
+        zero_state.dictionary_suffix = zero_state
+        # Breadth first, a suffix is always shallower than its state.
+        queue = deque([zero_state])
+        while queue:
+            state = queue.popleft()
+            for child in state.transitions.values():
+                suffix = child.longest_strict_suffix
+                child.dictionary_suffix = suffix if suffix.success \
+                    else suffix.dictionary_suffix
+                queue.append(child)
+
+    def compact(self):
+        '''
+        Convert the finalized tree into a CompactKeywordTree.
+        The compact tree yields the same search_all results, but stores
+        all states in a handful of flat integer arrays instead of one
+        State object and transition dict per node.
+        '''
+        if not self._finalized:
+            raise ValueError('KeywordTree has not been finalized.' +
+                             ' Call finalize() before compact().')
+        zero_state = self._zero_state
+
+        # Number the states breadth first, so that the children of a state
+        # and the states visited after a failure are close together.
+        trie_states = [zero_state]
+        numbers = {zero_state.identifier: 0}
+        queue = deque([zero_state])
+        while queue:
+            state = queue.popleft()
+            for child in state.transitions.values():
+                numbers[child.identifier] = len(trie_states)
+                trie_states.append(child)
+                queue.append(child)
+
+        alphabet = sorted(set(state.symbol for state in trie_states[1:]))
+        char_ids = {char: char_id for char_id, char in enumerate(alphabet)}
+
+        offsets = array('i', [0])
+        labels = array('i')
+        targets = array('i')
+        fail = array('i')
+        dictionary_suffix = array('i')
+        keyword_index = array('i')
+        keywords = [None] * self._num_keywords
+        payload_width = 0
+        for state in trie_states:
+            if state.payload is not None:
+                payload_width = len(state.payload)
                 break
+        payloads = array('i', [0]) * (self._num_keywords * payload_width)
+        for state in trie_states:
+            children = sorted(
+                (char_ids[symbol], numbers[child.identifier])
+                for symbol, child in state.transitions.items())
+            for char_id, target in children:
+                labels.append(char_id)
+                targets.append(target)
+            offsets.append(len(labels))
+            fail.append(numbers[state.longest_strict_suffix.identifier])
+            dictionary_suffix.append(
+                numbers[state.dictionary_suffix.identifier])
+            if state.success:
+                keyword_id = state.keyword_id
+                keyword_index.append(keyword_id)
+                keywords[keyword_id] = state.matched_keyword
+                payload = state.payload or (0,) * payload_width
+                if len(payload) != payload_width:
+                    raise ValueError('Payloads of a compacted tree must ' +
+                                     'all have the same length.')
+                start = keyword_id * payload_width
+                payloads[start:start + payload_width] = array('i', payload)
             else:
-                traversed = traversed.longest_strict_suffix
-        suffix = state.longest_strict_suffix
-        if suffix is zero_state:
-            return
-        if suffix.longest_strict_suffix is None:
-            self.search_lss(suffix)
-        for symbol, next_state in suffix.transitions.items():
-            if symbol not in state.transitions:
-                state.transitions[symbol] = next_state
+                keyword_index.append(-1)
+        if payloads and 0 <= min(payloads) and max(payloads) < 256:
+            payloads = array('B', payloads)
+
+        root_transitions = array('i', [0]) * len(alphabet)
+        for pos in range(offsets[0], offsets[1]):
+            root_transitions[labels[pos]] = targets[pos]
+
+        return CompactKeywordTree(self._case_insensitive, alphabet, offsets,
+                                  labels, targets, root_transitions, fail,
+                                  dictionary_suffix, keyword_index, keywords,
+                                  payload_width, payloads)
+
+    def save(self, path):
+        '''
+        Write the finalized tree to path in the binary format read by
+        CompactKeywordTree.load().
+        '''
+        self.compact().save(path)
 
     def __str__(self):
         return "ahocorapy KeywordTree"
@@ -185,7 +602,10 @@ class KeywordTree(object):
                 'success': state.success,
                 'parent':  state.parent.identifier if state.parent is not None else None,
                 'matched_keyword': state.matched_keyword,
+                'keyword_id': state.keyword_id,
+                'payload': state.payload,
                 'longest_strict_suffix': state.longest_strict_suffix.identifier if state.longest_strict_suffix is not None else None,
+                'dictionary_suffix': state.dictionary_suffix.identifier if state.dictionary_suffix is not None else None,
                 'transitions': transitions
             }
             for child in state.transitions.values():
@@ -196,18 +616,24 @@ class KeywordTree(object):
             'case_insensitive': self._case_insensitive,
             'finalized': self._finalized,
             'counter': self._counter,
+            'num_keywords': self._num_keywords,
             'states': state_list
         }
 
     def __setstate__(self, state):
         self._case_insensitive = state['case_insensitive']
         self._counter = state['counter']
+        self._num_keywords = state.get('num_keywords', 0)
         self._finalized = state['finalized']
+        self._fail_children = None
+        self._states_for_symbol = None
         states = [None] * len(state['states'])
         for idx, serialized_state in enumerate(state['states']):
             deserialized_state = State(idx, serialized_state['symbol'])
             deserialized_state.success = serialized_state['success']
             deserialized_state.matched_keyword = serialized_state['matched_keyword']
+            deserialized_state.keyword_id = serialized_state.get('keyword_id')
+            deserialized_state.payload = serialized_state.get('payload')
             states[idx] = deserialized_state
         for idx, serialized_state in enumerate(state['states']):
             deserialized_state = states[idx]
@@ -216,10 +642,504 @@ class KeywordTree(object):
                     serialized_state['longest_strict_suffix']]
             else:
                 deserialized_state.longest_strict_suffix = None
+            if serialized_state.get('dictionary_suffix') is not None:
+                deserialized_state.dictionary_suffix = states[
+                    serialized_state['dictionary_suffix']]
+            else:
+                deserialized_state.dictionary_suffix = None
             if serialized_state['parent'] is not None:
                 deserialized_state.parent = states[serialized_state['parent']]
             else:
                 deserialized_state.parent = None
+            # Trees pickled before finalize() was breadth first also hold
+            # the transitions that were copied over from the suffixes.
             deserialized_state.transitions = {
-                key: states[value] for key, value in serialized_state['transitions'].items()}
+                key: states[value] for key, value in serialized_state['transitions'].items()
+                if serialized_state['parent'] is None or state['states'][value]['parent'] == idx}
         self._zero_state = states[0]
+        # Trees pickled before dictionary suffixes and keyword ids existed.
+        if self._finalized and self._zero_state.dictionary_suffix is None:
+            self.link_dictionary_suffixes()
+        if 'num_keywords' not in state:
+            for deserialized_state in states:
+                if deserialized_state.success:
+                    deserialized_state.keyword_id = self._num_keywords
+                    self._num_keywords += 1
+
+
+class KeywordPool(object):
+    '''
+    Read-only sequence of the keywords stored in a binary tree file.
+    Keywords are decoded from the UTF-8 string pool the first time they
+    are requested.
+    '''
+
+    def __init__(self, offsets, pool):
+        self._offsets = offsets
+        self._pool = pool
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        try:
+            return self._decoded[index]
+        except KeyError:
+            keyword = self._pool[self._offsets[index]:
+                                 self._offsets[index + 1]].tobytes()\
+                .decode('utf-8')
+            self._decoded[index] = keyword
+            return keyword
+
+
+class CompactKeywordTree(object):
+    '''
+    Finalized, read-only keyword tree stored in flat integer arrays.
+    Create one with KeywordTree.compact().
+
+    Characters are mapped to dense ids. The trie edges of all states are
+    stored CSR style: the edges of state s are labels[offsets[s]:offsets[s+1]]
+    (sorted char ids) with the matching targets. fail holds the longest
+    strict suffix of every state, dictionary_suffix the closest of those
+    suffixes that completes a keyword, and keyword_index holds the id of
+    the keyword a state completes (-1 otherwise). Keyword ids number the
+    keywords in the order they were first added, keyword i is keywords[i]
+    and carries the payload payloads[i * payload_width:(i + 1) *
+    payload_width]. payloads is an array of int32, or of bytes when all
+    values fit into one.
+
+    save() writes these arrays to a binary file that load() maps into
+    memory and searches in place:
+
+        header       magic, format version, byte order mark, flags, the
+                     number of chars, states, edges and keywords, the
+                     payload width and typecode, and the pool size in bytes
+        alphabet     int32 code point per char id
+        offsets      int32 per state + 1
+        labels       int32 per edge
+        targets      int32 per edge
+        root         int32 per char id, the child of the zero state
+        fail         int32 per state
+        dict_suffix  int32 per state
+        keyword_ix   int32 per state
+        pool_offsets int32 per keyword + 1, byte offsets into the pool
+        pool         UTF-8 encoded keywords, padded to a multiple of 4
+        payloads     int32 or byte per keyword * payload width
+    '''
+
+    MAGIC = b'AHOCKWT\0'
+    FORMAT_VERSION = 6
+    _BYTE_ORDER_MARK = 0x01020304
+    _HEADER = struct.Struct('=8sIIIIIIIIII')
+    _FLAG_CASE_INSENSITIVE = 1
+
+    def __init__(self, case_insensitive, alphabet, offsets, labels, targets,
+                 root_transitions, fail, dictionary_suffix, keyword_index,
+                 keywords, payload_width=0, payloads=None):
+        self._case_insensitive = case_insensitive
+        self._alphabet = alphabet
+        self._char_ids = {char: char_id for char_id,
+                          char in enumerate(alphabet)}
+        self._offsets = offsets
+        self._labels = labels
+        self._targets = targets
+        self._root_transitions = root_transitions
+        self._fail = fail
+        self._dictionary_suffix = dictionary_suffix
+        self._keyword_index = keyword_index
+        self._keywords = keywords
+        self._payload_width = payload_width
+        self._payloads = payloads if payloads is not None else array('i')
+        self._mapped = None
+
+    def search(self, text):
+        '''
+        Alias for the search_one method
+        '''
+        return self.search_one(text)
+
+    def search_one(self, text):
+        '''
+        Search a text for any occurence of any added keyword.
+        Returns when one keyword has been found.
+        @return: 2-Tuple with keyword and startindex in text.
+                 Or None if no keyword was found in the text.
+        '''
+        result_gen = self.search_all(text)
+        try:
+            return next(result_gen)
+        except StopIteration:
+            return None
+
+    def search_all(self, text):
+        '''
+        Search a text for all occurences of the keywords.
+        Yields the same results, in the same order, as
+        KeywordTree.search_all.
+        O(n) with n = len(text)
+        @return: Generator used to iterate over the results.
+        '''
+        if self._case_insensitive:
+            text = text.lower()
+        char_ids = self._char_ids
+        offsets = self._offsets
+        labels = self._labels
+        targets = self._targets
+        root_transitions = self._root_transitions
+        fail = self._fail
+        dictionary_suffix = self._dictionary_suffix
+        keyword_index = self._keyword_index
+        keywords = self._keywords
+        current_state = 0
+        for idx, symbol in enumerate(text):
+            char_id = char_ids.get(symbol)
+            if char_id is None:
+                current_state = 0
+                continue
+            while current_state:
+                lo = offsets[current_state]
+                hi = offsets[current_state + 1]
+                pos = bisect_left(labels, char_id, lo, hi)
+                if pos < hi and labels[pos] == char_id:
+                    current_state = targets[pos]
+                    break
+                current_state = fail[current_state]
+            else:
+                current_state = root_transitions[char_id]
+            state = current_state
+            if keyword_index[state] < 0:
+                state = dictionary_suffix[state]
+            while state:
+                keyword = keywords[keyword_index[state]]
+                yield (keyword, idx + 1 - len(keyword))
+                state = dictionary_suffix[state]
+
+    def search_all_with_payloads(self, text):
+        '''
+        Like search_all, but yields 3-Tuples of keyword, startindex and
+        the payload the keyword was added with, as a tuple of ints.
+        '''
+        if self._case_insensitive:
+            text = text.lower()
+        char_ids = self._char_ids
+        offsets = self._offsets
+        labels = self._labels
+        targets = self._targets
+        root_transitions = self._root_transitions
+        fail = self._fail
+        dictionary_suffix = self._dictionary_suffix
+        keyword_index = self._keyword_index
+        keywords = self._keywords
+        payload_width = self._payload_width
+        payloads = self._payloads
+        current_state = 0
+        for idx, symbol in enumerate(text):
+            char_id = char_ids.get(symbol)
+            if char_id is None:
+                current_state = 0
+                continue
+            while current_state:
+                lo = offsets[current_state]
+                hi = offsets[current_state + 1]
+                pos = bisect_left(labels, char_id, lo, hi)
+                if pos < hi and labels[pos] == char_id:
+                    current_state = targets[pos]
+                    break
+                current_state = fail[current_state]
+            else:
+                current_state = root_transitions[char_id]
+            state = current_state
+            if keyword_index[state] < 0:
+                state = dictionary_suffix[state]
+            while state:
+                index = keyword_index[state]
+                keyword = keywords[index]
+                start = index * payload_width
+                yield (keyword, idx + 1 - len(keyword),
+                       tuple(payloads[start:start + payload_width]))
+                state = dictionary_suffix[state]
+
+    def search_words(self, text, policy=LEFTMOST_LONGEST):
+        '''
+        Segment a text into non-overlapping keywords.
+        @param policy: LEFTMOST_LONGEST or RIGHTMOST_LONGEST.
+        @return: Generator of 2-Tuples with keyword and startindex in text,
+                 in text order.
+        '''
+        if self._case_insensitive:
+            text = text.lower()
+        keyword_index = self._keyword_index
+        keywords = self._keywords
+        for state, start in self._segment(text, policy):
+            yield (keywords[keyword_index[state]], start)
+
+    def _segment(self, text, policy):
+        '''
+        @return: List of (state, startindex) of the keywords the policy
+                 segments the (already lowercased) text into.
+        '''
+        char_ids = self._char_ids
+        offsets = self._offsets
+        labels = self._labels
+        targets = self._targets
+        root_transitions = self._root_transitions
+        fail = self._fail
+        dictionary_suffix = self._dictionary_suffix
+        keyword_index = self._keyword_index
+        keywords = self._keywords
+        segments = []
+        if policy == LEFTMOST_LONGEST:
+            symbols = [char_ids.get(symbol) for symbol in text]
+            length = len(symbols)
+            start = 0
+            while start < length:
+                char_id = symbols[start]
+                state = 0 if char_id is None else root_transitions[char_id]
+                longest = 0
+                end = start + 1
+                idx = start + 1
+                while state:
+                    if keyword_index[state] >= 0:
+                        longest = state
+                        end = idx
+                    if idx == length:
+                        break
+                    char_id = symbols[idx]
+                    if char_id is None:
+                        break
+                    lo = offsets[state]
+                    hi = offsets[state + 1]
+                    pos = bisect_left(labels, char_id, lo, hi)
+                    if pos == hi or labels[pos] != char_id:
+                        break
+                    state = targets[pos]
+                    idx += 1
+                if longest:
+                    segments.append((longest, start))
+                start = end
+        elif policy == RIGHTMOST_LONGEST:
+            # The longest keyword ending at each index is the first one
+            # search_all reports there.
+            longest_ending_at = []
+            current_state = 0
+            for symbol in text:
+                char_id = char_ids.get(symbol)
+                if char_id is None:
+                    current_state = 0
+                    longest_ending_at.append(0)
+                    continue
+                while current_state:
+                    lo = offsets[current_state]
+                    hi = offsets[current_state + 1]
+                    pos = bisect_left(labels, char_id, lo, hi)
+                    if pos < hi and labels[pos] == char_id:
+                        current_state = targets[pos]
+                        break
+                    current_state = fail[current_state]
+                else:
+                    current_state = root_transitions[char_id]
+                longest_ending_at.append(
+                    current_state if keyword_index[current_state] >= 0
+                    else dictionary_suffix[current_state])
+            end = len(text)
+            while end > 0:
+                state = longest_ending_at[end - 1]
+                if state:
+                    end -= len(keywords[keyword_index[state]])
+                    segments.append((state, end))
+                else:
+                    end -= 1
+            segments.reverse()
+        else:
+            raise ValueError('Unknown match policy {0}.'.format(policy))
+        return segments
+
+    def search_ids(self, texts, seen=None, policy=OVERLAPPING):
+        '''
+        Batch search. Yields, for each of the texts, the set of ids of the
+        distinct keywords found in it.
+        @param seen: Optional set of keyword ids to leave out. The reported
+                     ids are added to it, so every keyword is reported for
+                     the first text it occurs in only.
+        @param policy: One of MATCH_POLICIES. With LEFTMOST_LONGEST or
+                       RIGHTMOST_LONGEST only the keywords the text is
+                       segmented into are reported.
+        '''
+        char_ids = self._char_ids
+        offsets = self._offsets
+        labels = self._labels
+        targets = self._targets
+        root_transitions = self._root_transitions
+        fail = self._fail
+        dictionary_suffix = self._dictionary_suffix
+        keyword_index = self._keyword_index
+        for text in texts:
+            if self._case_insensitive:
+                text = text.lower()
+            if policy != OVERLAPPING:
+                found = {keyword_index[state]
+                         for state, _ in self._segment(text, policy)}
+                if seen is not None:
+                    found -= seen
+                    seen |= found
+                yield found
+                continue
+            # Once a state has been reported, so has its dictionary suffix
+            # chain, which lets the walk stop early.
+            found_states = set()
+            current_state = 0
+            for symbol in text:
+                char_id = char_ids.get(symbol)
+                if char_id is None:
+                    current_state = 0
+                    continue
+                while current_state:
+                    lo = offsets[current_state]
+                    hi = offsets[current_state + 1]
+                    pos = bisect_left(labels, char_id, lo, hi)
+                    if pos < hi and labels[pos] == char_id:
+                        current_state = targets[pos]
+                        break
+                    current_state = fail[current_state]
+                else:
+                    current_state = root_transitions[char_id]
+                state = current_state
+                if keyword_index[state] < 0:
+                    state = dictionary_suffix[state]
+                while state and state not in found_states:
+                    found_states.add(state)
+                    state = dictionary_suffix[state]
+            found = {keyword_index[state] for state in found_states}
+            if seen is not None:
+                found -= seen
+                seen |= found
+            yield found
+
+    def keyword(self, keyword_id):
+        '''
+        @return: The keyword with the given id.
+        '''
+        return self._keywords[keyword_id]
+
+    def payload(self, keyword_id):
+        '''
+        @return: The payload of the keyword with the given id.
+        '''
+        start = keyword_id * self._payload_width
+        return tuple(self._payloads[start:start + self._payload_width])
+
+    def payload_column(self, index):
+        '''
+        @return: Sequence of field index of the payloads, indexed by
+                 keyword id.
+        '''
+        return self._payloads[index::self._payload_width]
+
+    def __len__(self):
+        return len(self._keywords)
+
+    def save(self, path):
+        '''
+        Write the tree to path in the binary format read by load().
+        '''
+        pool = bytearray()
+        pool_offsets = array('i', [0])
+        for keyword in self._keywords:
+            pool += keyword.encode('utf-8')
+            pool_offsets.append(len(pool))
+        flags = self._FLAG_CASE_INSENSITIVE if self._case_insensitive else 0
+        header = self._HEADER.pack(
+            self.MAGIC, self.FORMAT_VERSION, self._BYTE_ORDER_MARK, flags,
+            len(self._alphabet), len(self._fail), len(self._labels),
+            len(self._keywords), self._payload_width,
+            ord(self._payloads.typecode if isinstance(self._payloads, array)
+                else self._payloads.format), len(pool))
+        sections = [
+            array('i', (ord(char) for char in self._alphabet)),
+            self._offsets,
+            self._labels,
+            self._targets,
+            self._root_transitions,
+            self._fail,
+            self._dictionary_suffix,
+            self._keyword_index,
+            pool_offsets,
+        ]
+        pool += bytes(-len(pool) % 4)
+        with open(path, 'wb') as tree_file:
+            tree_file.write(header)
+            for section in sections:
+                tree_file.write(array('i', section).tobytes())
+            tree_file.write(pool)
+            tree_file.write(self._payloads.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Open a tree written by save(). The file is memory mapped and
+        searched in place, nothing but the char id map is copied to the
+        heap.
+        '''
+        with open(path, 'rb') as tree_file:
+            mapped = mmap.mmap(tree_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # The sizes in the header must add up to the size of the file, a
+        # truncated or otherwise damaged file is rejected before any of it
+        # is read.
+        try:
+            if len(mapped) < cls._HEADER.size:
+                raise ValueError('{0} is not a keyword tree file.'
+                                 .format(path))
+            (magic, version, byte_order_mark, flags, num_chars, num_states,
+             num_edges, num_keywords, payload_width, payload_typecode,
+             pool_size) = \
+                cls._HEADER.unpack_from(mapped)
+            if magic != cls.MAGIC:
+                raise ValueError('{0} is not a keyword tree file.'
+                                 .format(path))
+            if version != cls.FORMAT_VERSION:
+                raise ValueError('{0} has format version {1}, expected {2}.'
+                                 .format(path, version, cls.FORMAT_VERSION))
+            if byte_order_mark != cls._BYTE_ORDER_MARK:
+                raise ValueError('{0} was written with a different byte order.'
+                                 .format(path))
+
+            sizes = [num_chars, num_states + 1, num_edges, num_edges,
+                     num_chars, num_states, num_states, num_states,
+                     num_keywords + 1]
+            payload_typecode = chr(payload_typecode)
+            if payload_typecode not in ('B', 'i'):
+                raise ValueError('{0} has an unknown payload type.'
+                                 .format(path))
+            ints_end = cls._HEADER.size + 4 * sum(sizes)
+            pool_end = ints_end + pool_size + -pool_size % 4
+            payloads_end = pool_end + \
+                num_keywords * payload_width * array(payload_typecode).itemsize
+            if len(mapped) != payloads_end:
+                raise ValueError('{0} is {1} bytes long, expected {2}.'
+                                 .format(path, len(mapped), payloads_end))
+        except ValueError:
+            # Unmapped right away, so the file can be deleted.
+            mapped.close()
+            raise
+        view = memoryview(mapped)
+        ints = view[cls._HEADER.size:ints_end].cast('i')
+        sections = []
+        start = 0
+        for size in sizes:
+            sections.append(ints[start:start + size])
+            start += size
+        (alphabet, offsets, labels, targets, root_transitions, fail,
+         dictionary_suffix, keyword_index, pool_offsets) = sections
+        pool = view[ints_end:ints_end + pool_size]
+        payloads = view[pool_end:payloads_end].cast(payload_typecode)
+
+        tree = cls(bool(flags & cls._FLAG_CASE_INSENSITIVE),
+                   ''.join(map(chr, alphabet)), offsets, labels, targets,
+                   root_transitions, fail, dictionary_suffix, keyword_index,
+                   KeywordPool(pool_offsets, pool), payload_width, payloads)
+        tree._mapped = mapped
+        return tree
+
+    def __str__(self):
+        return "ahocorapy CompactKeywordTree"
@@ -33,6 +33,7 @@ try:
   import html  # Python version 3.2 or higher
 except ImportError:
   import cgi as html  # Only used for .escape()
+import io
 import numbers
 import json
 import types
@@ -168,6 +169,12 @@ class DataTable(object):
     """
     self.__columns = self.TableDescriptionParser(table_description)
     self.__data = []
+    # Data loaded by LoadColumns(), kept as columns until rows are needed:
+    # (values by column ID, number of rows, custom properties of the rows).
+    self.__column_data = None
+    # The row orders computed by _RowOrder() for the current data, by
+    # normalized order_by.
+    self.__row_orders = {}
     self.custom_properties = {}
     if custom_properties is not None:
       self.custom_properties = custom_properties
@@ -273,6 +280,44 @@ class DataTable(object):
     # supported types.
     raise DataTableException("Unsupported type %s" % value_type)
 
+  # The Python types whose values CoerceValue returns unchanged for each
+  # column type. A column holding only these (and None) needs no coercion.
+  _NATIVE_TYPES = {
+      "boolean": (bool,),
+      "number": (int, float),
+      "string": (six.text_type,),
+      "date": (datetime.date,),
+      "datetime": (datetime.datetime,),
+      "timeofday": (datetime.time,),
+  }
+
+  @staticmethod
+  def CoerceColumn(values, value_type):
+    """Coerces all the values of a column into the type expected for it.
+
+    Internal helper method. The types are checked once for the whole column,
+    CoerceValue() is only called for every value when some of them are not
+    of a native type for the column.
+
+    Args:
+      values: The values of the column.
+      value_type: The type of the column, as for CoerceValue().
+
+    Returns:
+      A list of the coerced values.
+
+    Raises:
+      DataTableException: One of the values could not be coerced.
+    """
+    if value_type not in DataTable._NATIVE_TYPES:
+      raise DataTableException("Unsupported type %s" % value_type)
+    values = list(values)
+    value_types = set(map(type, values))
+    value_types.discard(type(None))
+    if value_types.issubset(DataTable._NATIVE_TYPES[value_type]):
+      return values
+    return [DataTable.CoerceValue(value, value_type) for value in values]
+
   @staticmethod
   def EscapeForJSCode(encoder, value):
     if value is None:
@@ -535,8 +580,22 @@ class DataTable(object):
 
   def NumberOfRows(self):
     """Returns the number of rows in the current data stored in the table."""
+    if self.__column_data is not None:
+      return self.__column_data[1]
     return len(self.__data)
 
+  def _RowData(self):
+    """Returns the rows, converting data loaded by LoadColumns() first."""
+    if self.__column_data is not None:
+      column_values, num_rows, custom_properties = self.__column_data
+      self.__data = [({}, custom_properties) for _ in range(num_rows)]
+      for col_id, values in column_values.items():
+        for (row, unused_cp), value in zip(self.__data, values):
+          if value is not None:
+            row[col_id] = value
+      self.__column_data = None
+    return self.__data
+
   def SetRowsCustomProperties(self, rows, custom_properties):
     """Sets the custom properties for given row(s).
 
@@ -550,8 +609,9 @@ class DataTable(object):
     """
     if not hasattr(rows, "__iter__"):
       rows = [rows]
+    data = self._RowData()
     for row in rows:
-      self.__data[row] = (self.__data[row][0], custom_properties)
+      data[row] = (data[row][0], custom_properties)
 
   def LoadData(self, data, custom_properties=None):
     """Loads new rows to the data table, clearing existing rows.
@@ -566,8 +626,49 @@ class DataTable(object):
                          properties for all rows.
     """
     self.__data = []
+    self.__column_data = None
+    self.__row_orders = {}
     self.AppendData(data, custom_properties)
 
+  def LoadColumns(self, columns, custom_properties=None):
+    """Loads new rows to the data table from columns, clearing existing rows.
+
+    Unlike LoadData(), the data is given per column, which is how a time
+    series is usually built: the values of every column are checked and
+    coerced at once, and ToJSon() writes them out without creating an object
+    per row or cell.
+
+    Args:
+      columns: A dictionary from column ID to the values of that column, one
+               per row. All columns must have the same number of values.
+               Columns that are left out are empty in every row. The values
+               are as described in CoerceValue().
+      custom_properties: A dictionary of string to string to set as the custom
+                         properties for all rows.
+
+    Raises:
+      DataTableException: A column ID is not in the table description, the
+                          columns don't have the same number of values, or a
+                          value does not match the type of its column.
+    """
+    col_dict = dict([(col["id"], col) for col in self.__columns])
+    column_values = {}
+    num_rows = None
+    for col_id, values in columns.items():
+      if col_id not in col_dict:
+        raise DataTableException("Column %s is not in the table description" %
+                                 col_id)
+      values = self.CoerceColumn(values, col_dict[col_id]["type"])
+      if num_rows is None:
+        num_rows = len(values)
+      elif len(values) != num_rows:
+        raise DataTableException("Column %s has %d values, expected %d" %
+                                 (col_id, len(values), num_rows))
+      column_values[col_id] = values
+    self.__data = []
+    self.__column_data = (column_values, num_rows or 0, custom_properties)
+    self.__row_orders = {}
+
   def AppendData(self, data, custom_properties=None):
     """Appends new data to the table.
 
@@ -585,6 +686,8 @@ class DataTable(object):
     Raises:
       DataTableException: The data structure does not match the description.
     """
+    self._RowData()
+    self.__row_orders = {}
     # If the maximal depth is 0, we simply iterate over the data table
     # lines and insert them using _InnerAppendData. Otherwise, we simply
     # let the _InnerAppendData handle all the levels.
@@ -663,26 +766,96 @@ class DataTable(object):
     Raises:
       DataTableException: Sort direction not in 'asc' or 'desc'
     """
-    if not order_by:
-      return self.__data
+    data = self._RowData()
+    row_order = self._RowOrder(order_by)
+    if row_order is None:
+      return data
+    return [data[row] for row in row_order]
+
+  @staticmethod
+  def _NormalizedOrderBy(order_by):
+    """Returns order_by, as for _PreparedData(), as ((column ID, reverse), ...).
 
-    sorted_data = self.__data[:]
+    Raises:
+      DataTableException: Sort direction not in 'asc' or 'desc'
+    """
     if isinstance(order_by, six.string_types) or (
         isinstance(order_by, tuple) and len(order_by) == 2 and
         order_by[1].lower() in ["asc", "desc"]):
       order_by = (order_by,)
-    for key in reversed(order_by):
+    keys = []
+    for key in order_by:
       if isinstance(key, six.string_types):
-        sorted_data.sort(key=lambda x: x[0].get(key))
+        keys.append((key, False))
       elif (isinstance(key, (list, tuple)) and len(key) == 2 and
             key[1].lower() in ("asc", "desc")):
-        key_func = lambda x: x[0].get(key[0])
-        sorted_data.sort(key=key_func, reverse=key[1].lower() != "asc")
+        keys.append((key[0], key[1].lower() != "asc"))
       else:
         raise DataTableException("Expected tuple with second value: "
                                  "'asc' or 'desc'")
+    return tuple(keys)
+
+  def _RowOrder(self, order_by):
+    """Returns the order of the rows for order_by.
 
-    return sorted_data
+    The rows are sorted once for every run of keys with the same direction,
+    with a tuple of their values as the sort key, and not at all when they
+    already are in order, which is checked in linear time. The result is
+    kept until the data changes.
+
+    Args:
+      order_by: Optional. As for _PreparedData().
+
+    Returns:
+      A list of row indexes, or None if the rows are already in order.
+
+    Raises:
+      DataTableException: Sort direction not in 'asc' or 'desc'
+    """
+    if not order_by:
+      return None
+    keys = self._NormalizedOrderBy(order_by)
+    if keys in self.__row_orders:
+      return self.__row_orders[keys]
+
+    if self.__column_data is not None:
+      column_values, num_rows, unused_cp = self.__column_data
+      empty_column = [None] * num_rows
+      key_columns = [column_values.get(col_id, empty_column)
+                     for col_id, unused_reverse in keys]
+    else:
+      num_rows = len(self.__data)
+      key_columns = [[row.get(col_id) for row, unused_cp in self.__data]
+                     for col_id, unused_reverse in keys]
+
+    # Runs of keys sorted in the same direction, ordered from the last key
+    # to the first, as each stable sort takes precedence over the previous.
+    runs = []
+    for (col_id, reverse), values in zip(keys, key_columns):
+      if runs and runs[-1][0] == reverse:
+        runs[-1][1].append(values)
+      else:
+        runs.append((reverse, [values]))
+    run_keys = []
+    for reverse, columns in reversed(runs):
+      run_keys.append((reverse, columns[0] if len(columns) == 1 else
+                       list(zip(*columns))))
+
+    if len(run_keys) == 1:
+      reverse, values = run_keys[0]
+      if reverse:
+        in_order = all(a >= b for a, b in zip(values, values[1:]))
+      else:
+        in_order = all(a <= b for a, b in zip(values, values[1:]))
+      if in_order:
+        self.__row_orders[keys] = None
+        return None
+
+    row_order = list(range(num_rows))
+    for reverse, values in run_keys:
+      row_order.sort(key=values.__getitem__, reverse=reverse)
+    self.__row_orders[keys] = row_order
+    return row_order
 
   def ToJSCode(self, name, columns_order=None, order_by=()):
     """Writes the data table as a JS code string.
@@ -745,7 +918,7 @@ class DataTable(object):
       if col_dict[col]["custom_properties"]:
         jscode += "%s.setColumnProperties(%d, %s);\n" % (
             name, i, encoder.encode(col_dict[col]["custom_properties"]))
-    jscode += "%s.addRows(%d);\n" % (name, len(self.__data))
+    jscode += "%s.addRows(%d);\n" % (name, self.NumberOfRows())
 
     # We now go over the data and add each row
     for (i, (row, cp)) in enumerate(self._PreparedData(order_by)):
@@ -932,14 +1105,7 @@ class DataTable(object):
     col_dict = dict([(col["id"], col) for col in self.__columns])
 
     # Creating the column JSON objects
-    col_objs = []
-    for col_id in columns_order:
-      col_obj = {"id": col_dict[col_id]["id"],
-                 "label": col_dict[col_id]["label"],
-                 "type": col_dict[col_id]["type"]}
-      if col_dict[col_id]["custom_properties"]:
-        col_obj["p"] = col_dict[col_id]["custom_properties"]
-      col_objs.append(col_obj)
+    col_objs = self._ColumnJSonObjs(columns_order)
 
     # Creating the rows jsons
     row_objs = []
@@ -969,6 +1135,210 @@ class DataTable(object):
 
     return json_obj
 
+  def _ColumnJSonObjs(self, columns_order):
+    """Returns the objects describing the given columns in the JSON output."""
+    col_dict = dict([(col["id"], col) for col in self.__columns])
+    col_objs = []
+    for col_id in columns_order:
+      col_obj = {"id": col_dict[col_id]["id"],
+                 "label": col_dict[col_id]["label"],
+                 "type": col_dict[col_id]["type"]}
+      if col_dict[col_id]["custom_properties"]:
+        col_obj["p"] = col_dict[col_id]["custom_properties"]
+      col_objs.append(col_obj)
+    return col_objs
+
+  @staticmethod
+  def _JSonCellEncoder(encoder):
+    """Returns a function writing a coerced value as a cell of the JSON output.
+
+    The cells are the same as the ones _ToJSonObj() creates, but the common
+    values are formatted directly instead of through the JSON encoder.
+
+    Args:
+      encoder: The DataTableJSONEncoder for everything else.
+    """
+    def EncodeCell(value):
+      value_type = type(value)
+      if value is None:
+        return "null"
+      elif value_type is int:
+        return "{\"v\":%d}" % value
+      elif value_type is datetime.date:
+        return "{\"v\":\"Date(%d,%d,%d)\"}" % (value.year, value.month - 1,
+                                                 value.day)
+      elif value_type is tuple:
+        cell_obj = {"v": value[0]}
+        if len(value) > 1 and value[1] is not None:
+          cell_obj["f"] = value[1]
+        if len(value) == 3:
+          cell_obj["p"] = value[2]
+        return encoder.encode(cell_obj)
+      return "{\"v\":%s}" % encoder.encode(value)
+    return EncodeCell
+
+  def _WriteColumnsJSon(self, out, columns_order, order_by):
+    """Writes the data loaded by LoadColumns() as JSON, like ToJSon().
+
+    The cells of every column are formatted at once and the rows are written
+    to out as they are joined, no object is created per row.
+
+    Args:
+      out: A text stream to write to.
+      columns_order: Optional. As for ToJSon().
+      order_by: Optional. As for ToJSon().
+    """
+    if columns_order is None:
+      columns_order = [col["id"] for col in self.__columns]
+    encoder = DataTableJSONEncoder()
+    encode_cell = self._JSonCellEncoder(encoder)
+    column_values, num_rows, custom_properties = self.__column_data
+    row_order = self._RowOrder(order_by)
+
+    column_cells = []
+    for col_id in columns_order:
+      values = column_values.get(col_id)
+      if values is None:
+        column_cells.append(["null"] * num_rows)
+        continue
+      if row_order is not None:
+        values = [values[row] for row in row_order]
+      column_cells.append(list(map(encode_cell, values)))
+
+    row_end = "]}"
+    if custom_properties:
+      row_end = "]%s}" % (",\"p\":" + encoder.encode(custom_properties))
+    out.write("{\"cols\":")
+    out.write(encoder.encode(self._ColumnJSonObjs(columns_order)))
+    out.write(",\"rows\":[")
+    for row_index, row_cells in enumerate(zip(*column_cells)):
+      if row_index:
+        out.write(",")
+      out.write("{\"c\":[")
+      out.write(",".join(row_cells))
+      out.write(row_end)
+    out.write("]")
+    if self.custom_properties:
+      out.write(",\"p\":")
+      out.write(encoder.encode(self.custom_properties))
+    out.write("}")
+
+  @staticmethod
+  def _CompactCellEncoder(encoder, date_epoch):
+    """Returns a function writing a coerced value as a cell of ToCompactJSon().
+
+    Args:
+      encoder: The DataTableJSONEncoder for values that are not shortened.
+      date_epoch: The date that date and datetime values are offsets from.
+    """
+    datetime_epoch = datetime.datetime(date_epoch.year, date_epoch.month,
+                                       date_epoch.day)
+    def EncodeValue(value):
+      value_type = type(value)
+      if value is None:
+        return "null"
+      elif value_type is int:
+        return "%d" % value
+      elif value_type is datetime.date:
+        return "%d" % (value - date_epoch).days
+      elif value_type is datetime.datetime:
+        return "%d" % ((value - datetime_epoch) // datetime.timedelta(
+            milliseconds=1))
+      return encoder.encode(value)
+
+    def EncodeCell(value):
+      if type(value) is tuple:
+        cell = "{\"v\":%s" % EncodeValue(value[0])
+        if len(value) > 1 and value[1] is not None:
+          cell += ",\"f\":" + encoder.encode(value[1])
+        if len(value) == 3:
+          cell += ",\"p\":" + encoder.encode(value[2])
+        return cell + "}"
+      return EncodeValue(value)
+    return EncodeCell
+
+  def ToCompactJSon(self, columns_order=None, order_by=(),
+                    date_epoch=datetime.date(1970, 1, 1)):
+    """Returns a compact JSON string of the table, for pages that decode it.
+
+    ToJSon() wraps every cell in an object and every row in another one, and
+    writes dates as "Date(y,m,d)" strings, which makes the JSON several times
+    larger than the data. Here the rows are plain arrays of values. Dates are
+    the number of days since date_epoch, datetimes the number of milliseconds
+    since its midnight. Cells with a formatted value or custom properties
+    are still {"v": ..., "f": ..., "p": ...} objects. Row custom properties
+    are left out.
+
+    Args:
+      columns_order: Optional. As for ToJSon().
+      order_by: Optional. As for ToJSon().
+      date_epoch: Optional. The date the date and datetime values are
+                  offsets from.
+
+    Returns:
+      A JSON string of an object with the column descriptions as in ToJSon()
+      ("cols"), the epoch as [year, month - 1, day] ("dateEpoch"), the rows
+      ("rows") and the table custom properties, if any ("p").
+      Example result:
+       {"cols":[{"id":"d","label":"Date","type":"date"},
+                {"id":"n","label":"n","type":"number"}],
+        "dateEpoch":[1970,0,1],"rows":[[16436,1],[16437,3]]}
+
+      A page can rebuild the google.visualization.DataTable with:
+        var data = new google.visualization.DataTable();
+        compact.cols.forEach(function(col) {
+          data.addColumn(col.type, col.label, col.id);
+        });
+        // ... replacing every date cell d of the rows with
+        //   new Date(compact.dateEpoch[0], compact.dateEpoch[1],
+        //            compact.dateEpoch[2] + d)
+        data.addRows(compact.rows);
+
+    Raises:
+      DataTableException: The data does not match the type.
+    """
+    if columns_order is None:
+      columns_order = [col["id"] for col in self.__columns]
+    col_dict = dict([(col["id"], col) for col in self.__columns])
+    encoder = DataTableJSONEncoder()
+    encode_cell = self._CompactCellEncoder(encoder, date_epoch)
+
+    if self.__column_data is not None:
+      column_values, num_rows, unused_cp = self.__column_data
+      row_order = self._RowOrder(order_by)
+      columns = []
+      for col_id in columns_order:
+        values = column_values.get(col_id, [None] * num_rows)
+        if row_order is not None:
+          values = [values[row] for row in row_order]
+        columns.append(values)
+    else:
+      rows = self._PreparedData(order_by)
+      columns = [[self.CoerceValue(row.get(col_id, None), col_dict[col_id]["type"])
+                  for row, unused_cp in rows]
+                 for col_id in columns_order]
+
+    out = io.StringIO()
+    out.write("{\"cols\":")
+    out.write(encoder.encode(self._ColumnJSonObjs(columns_order)))
+    out.write(",\"dateEpoch\":[%d,%d,%d]" % (date_epoch.year,
+                                             date_epoch.month - 1,
+                                             date_epoch.day))
+    out.write(",\"rows\":[")
+    column_cells = [list(map(encode_cell, values)) for values in columns]
+    for row_index, row_cells in enumerate(zip(*column_cells)):
+      if row_index:
+        out.write(",")
+      out.write("[")
+      out.write(",".join(row_cells))
+      out.write("]")
+    out.write("]")
+    if self.custom_properties:
+      out.write(",\"p\":")
+      out.write(encoder.encode(self.custom_properties))
+    out.write("}")
+    return out.getvalue()
+
   def ToJSon(self, columns_order=None, order_by=()):
     """Returns a string that can be used in a JS DataTable constructor.
 
@@ -1007,6 +1377,11 @@ class DataTable(object):
       DataTableException: The data does not match the type.
     """
 
+    if self.__column_data is not None:
+      out = io.StringIO()
+      self._WriteColumnsJSon(out, columns_order, order_by)
+      return out.getvalue()
+
     encoded_response_str = DataTableJSONEncoder().encode(self._ToJSonObj(columns_order, order_by))
     if not isinstance(encoded_response_str, str):
       return encoded_response_str.encode("utf-8")
@@ -0,0 +1,43 @@
+import html
+import re
+
+# Turns the text of a note field into the text that is searched for words:
+# the markup Anki fields are full of is removed, so it can neither slow
+# down the search nor produce words that aren't in the text.
+
+# Bump when normalize_field changes what it returns, so the word ids cached
+# for the old normalized text are dropped.
+NORMALIZE_VERSION = 1
+
+# Elements whose content isn't text of the field: ruby annotations
+# (furigana, pinyin) and embedded code.
+hidden_element_pattern = re.compile(r'<(rt|rp|script|style)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+# Tags that start a new line, everything else is inline, like <b> inside a
+# word, and is removed without a trace.
+line_break_tag_pattern = re.compile(r'</?(br|div|p|li|tr|td|th|h[1-6])\b[^>]*>', re.IGNORECASE)
+tag_pattern = re.compile(r'<[^>]*>')
+sound_pattern = re.compile(r'\[sound:[^\]]*\]')
+# {{c1::answer}} or {{c1::answer::hint}}, the answer is the text.
+cloze_pattern = re.compile(r'\{\{c\d+::([^{}]*?)(?:::[^{}]*)?\}\}')
+# Anki's furigana syntax, e.g. 中文[zhōng wén], the reading is dropped.
+reading_pattern = re.compile(r' ?([^ >]+?)\[(.+?)\]')
+# The Han characters, everything else is dropped by cjk_only.
+non_cjk_pattern = re.compile(r'[^〇㐀-䶿一-鿿豈-﫿\U00020000-\U0002ebef]+')
+
+def normalize_field(text: str, cjk_only: bool = False) -> str:
+    text = sound_pattern.sub('', text)
+    # Clozes can be nested, the innermost ones are removed first.
+    while True:
+        unclozed_text = cloze_pattern.sub(r'\1', text)
+        if unclozed_text == text:
+            break
+        text = unclozed_text
+    text = hidden_element_pattern.sub('', text)
+    text = line_break_tag_pattern.sub('\n', text)
+    text = tag_pattern.sub('', text)
+    text = html.unescape(text)
+    text = reading_pattern.sub(r'\1', text)
+    if cjk_only:
+        # A line break keeps the words on either side of a dropped run apart.
+        text = non_cjk_pattern.sub('\n', text)
+    return text
@@ -0,0 +1,49 @@
+# SQL run against the Anki collection and the processing of its rows. Kept
+# free of Anki imports so the benchmarks can run the same queries against a
+# synthetic collection.
+
+# Separates the fields in notes.flds.
+FIELD_SEPARATOR = '\x1f'
+
+# The fields of the studied notes are read this many notes at a time.
+NOTES_PER_BATCH = 1000
+
+def studied_notes_query(model_ids_for_deck) -> str:
+    # Every note with a studied card in one of the configured decks, with the
+    # deck and the time of the first review of those cards, in order of that
+    # time. The fields are read by search_field_texts, in batches.
+    # model_ids_for_deck maps deck ids to the ids of the models searched in
+    # that deck. The ids are inlined, so they are converted to int first.
+    deck_conditions = []
+    for deck_id, model_ids in sorted(model_ids_for_deck.items()):
+        model_id_list = ",".join(str(int(model_id)) for model_id in sorted(model_ids))
+        deck_conditions.append("(cards.did={} and notes.mid in ({}))".format(int(deck_id), model_id_list))
+    return (
+        "select notes.id, notes.mid, cards.did, min(revlog.id) as date "
+        "from cards, notes, revlog "
+        "where ({}) and cards.queue>0 and notes.id=cards.nid and revlog.cid=cards.id "
+        "group by notes.id order by date"
+    ).format(" or ".join(deck_conditions))
+
+def search_field_texts(col_db, studied_notes, search_field_ords):
+    # Yields (note id, text of the search field, first review id) for the
+    # rows of studied_notes_query, in their order. The fields are read from
+    # col_db NOTES_PER_BATCH notes at a time, so only the fields of one
+    # batch are in memory.
+    for start in range(0, len(studied_notes), NOTES_PER_BATCH):
+        batch = studied_notes[start:start + NOTES_PER_BATCH]
+        fields_for_note_id = dict(col_db.execute("select id, flds from notes where id in ({})".format(
+            ",".join(str(int(note_id)) for note_id, _, _, _ in batch))))
+        for note_id, model_id, deck_id, first_review in batch:
+            fields = fields_for_note_id.get(note_id)
+            # Skip this note if it was deleted since it was queried.
+            if fields is None:
+                continue
+            # The fields of a note are stored in a single column, separated by FIELD_SEPARATOR.
+            field_ord = search_field_ords[(deck_id, model_id)]
+            note_fields = fields.split(FIELD_SEPARATOR, field_ord + 1)
+            # Skip this note if the associated search field no longer exists in the note.
+            if field_ord >= len(note_fields):
+                continue
+            yield note_id, note_fields[field_ord], first_review
+        del fields_for_note_id
@@ -0,0 +1,8 @@
+# pytest plugin, loaded by pytest.ini. The add-on directory is a package
+# whose __init__ needs Anki, so it is collected as a plain directory
+# instead of a package pytest would import.
+import pytest
+
+def pytest_collect_directory(path, parent):
+    if path == parent.config.rootpath:
+        return pytest.Dir.from_parent(parent, path=path)
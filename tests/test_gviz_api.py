@@ -0,0 +1,141 @@
+import datetime
+import json
+import random
+
+import pytest
+
+from gviz.gviz_api import DataTable, DataTableException
+
+DATE_EPOCH = datetime.date(2015, 1, 1)
+NUMBER_COLUMNS = ['col{}'.format(i) for i in range(4)]
+COLUMNS_ORDER = ['date'] + NUMBER_COLUMNS + ['s']
+ORDERS = [(), 'date', ('date', 'desc'), [('col0', 'desc'), ('date', 'asc')]]
+
+def table_description():
+    description = {'date': ('date', 'Date')}
+    for column in NUMBER_COLUMNS:
+        description[column] = ('number', column + ' ★')
+    description['s'] = ('string', 'S')
+    return description
+
+def random_columns(rng, rows):
+    # Missing values, formatted values and strings that need escaping, with
+    # repeated dates and col0 values so the ordering has ties to keep stable.
+    # The columns the tables are ordered by have no missing values, which
+    # can't be compared with the others.
+    columns = {'date': [DATE_EPOCH + datetime.timedelta(days=rng.randrange(rows // 2 + 1))
+                        for _ in range(rows)],
+               'col0': [rng.randrange(5) for _ in range(rows)]}
+    for column in NUMBER_COLUMNS[1:]:
+        columns[column] = [rng.choice([rng.randrange(100), None, 1.5, (3, '3$')]) for _ in range(rows)]
+    columns['s'] = [rng.choice(['a"b', '中文', None, '<x>']) for _ in range(rows)]
+    return columns
+
+def column_rows(columns, rows):
+    return [{column: values[i] for column, values in columns.items() if values[i] is not None}
+            for i in range(rows)]
+
+def loaded_tables(rng, rows, custom_properties=None):
+    columns = random_columns(rng, rows)
+    from_rows = DataTable(table_description(), custom_properties={'t': 'u'})
+    from_rows.LoadData(column_rows(columns, rows), custom_properties)
+    from_columns = DataTable(table_description(), custom_properties={'t': 'u'})
+    from_columns.LoadColumns(columns, custom_properties)
+    return from_rows, from_columns
+
+@pytest.mark.parametrize('custom_properties', [None, {'x': 'y'}])
+@pytest.mark.parametrize('rows', [0, 1, 50])
+def test_load_columns_matches_load_data(custom_properties, rows):
+    from_rows, from_columns = loaded_tables(random.Random(rows), rows, custom_properties)
+    assert from_columns.NumberOfRows() == rows
+    for order_by in ORDERS:
+        for columns_order in (None, COLUMNS_ORDER, list(reversed(COLUMNS_ORDER))):
+            assert from_columns.ToJSon(columns_order, order_by) == from_rows.ToJSon(columns_order, order_by)
+            assert (from_columns.ToCompactJSon(columns_order, order_by, DATE_EPOCH)
+                    == from_rows.ToCompactJSon(columns_order, order_by, DATE_EPOCH))
+        assert from_columns.ToCsv(COLUMNS_ORDER, order_by) == from_rows.ToCsv(COLUMNS_ORDER, order_by)
+
+def test_compact_json_matches_json():
+    from_rows, _ = loaded_tables(random.Random(0), 50)
+    for order_by in ORDERS:
+        full = json.loads(from_rows.ToJSon(COLUMNS_ORDER, order_by))
+        compact = json.loads(from_rows.ToCompactJSon(COLUMNS_ORDER, order_by, DATE_EPOCH))
+        assert compact['cols'] == full['cols']
+        assert compact['p'] == full['p']
+        assert compact['dateEpoch'] == [DATE_EPOCH.year, DATE_EPOCH.month - 1, DATE_EPOCH.day]
+        assert len(compact['rows']) == len(full['rows'])
+        for compact_row, full_row in zip(compact['rows'], full['rows']):
+            date = DATE_EPOCH + datetime.timedelta(days=compact_row[0])
+            assert full_row['c'][0]['v'] == 'Date({},{},{})'.format(date.year, date.month - 1, date.day)
+            for compact_cell, full_cell in zip(compact_row[1:], full_row['c'][1:]):
+                if isinstance(compact_cell, dict) or compact_cell is None:
+                    assert compact_cell == full_cell
+                else:
+                    assert compact_cell == full_cell['v']
+
+def test_load_columns_rejects_uneven_columns():
+    table = DataTable(table_description())
+    columns = random_columns(random.Random(0), 5)
+    columns['s'].pop()
+    with pytest.raises(DataTableException):
+        table.LoadColumns(columns)
+
+ORDER_DESCRIPTION = [('id', 'number'), ('a', 'number'), ('b', 'string'), ('c', 'date')]
+MULTI_KEY_ORDERS = ['a', ('a', 'desc'), [('a', 'asc'), ('b', 'asc')], [('a', 'desc'), ('b', 'desc'), ('c', 'asc')],
+                    [('b', 'asc'), ('c', 'desc'), ('a', 'desc')], [('c', 'asc'), ('a', 'asc')]]
+
+def brute_force_order(rows, order_by):
+    # What order_by means: a stable sort by each key, from the last to the first.
+    if isinstance(order_by, str) or (isinstance(order_by, tuple) and order_by[1] in ('asc', 'desc')):
+        order_by = [order_by]
+    rows = list(rows)
+    for key in reversed(order_by):
+        column, direction = (key, 'asc') if isinstance(key, str) else key
+        index = [name for name, unused_type in ORDER_DESCRIPTION].index(column)
+        rows.sort(key=lambda row: row[index], reverse=direction == 'desc')
+    return [row[0] for row in rows]
+
+def json_row_ids(table, order_by):
+    return [row['c'][0]['v'] for row in json.loads(table.ToJSon(None, order_by))['rows']]
+
+def random_order_rows(rng, rows):
+    return [[i, rng.randrange(4), rng.choice('xyz'), datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(3))]
+            for i in range(rows)]
+
+@pytest.mark.parametrize('seed', range(20))
+def test_order_by_matches_brute_force(seed):
+    rng = random.Random(seed)
+    rows = random_order_rows(rng, rng.randrange(60))
+    if seed % 4 == 0:
+        # Already in order for some of the keys, which skips the sort.
+        rows.sort(key=lambda row: row[1:])
+    elif seed % 4 == 1:
+        rows.sort(key=lambda row: row[1], reverse=True)
+    from_rows = DataTable(ORDER_DESCRIPTION)
+    from_rows.LoadData(rows)
+    from_columns = DataTable(ORDER_DESCRIPTION)
+    from_columns.LoadColumns({name: [row[i] for row in rows] for i, (name, unused_type) in enumerate(ORDER_DESCRIPTION)})
+    for order_by in MULTI_KEY_ORDERS:
+        expected = brute_force_order(rows, order_by)
+        # Twice, the second time from the kept order.
+        for _ in range(2):
+            assert json_row_ids(from_rows, order_by) == expected
+            assert json_row_ids(from_columns, order_by) == expected
+
+def test_order_by_is_recomputed_after_append():
+    rng = random.Random(0)
+    rows = random_order_rows(rng, 20)
+    rows.sort(key=lambda row: row[1])
+    table = DataTable(ORDER_DESCRIPTION)
+    table.LoadData(rows)
+    assert json_row_ids(table, 'a') == [row[0] for row in rows]
+    more_rows = [[20 + row[0]] + row[1:] for row in random_order_rows(rng, 20)]
+    table.AppendData(more_rows)
+    for order_by in MULTI_KEY_ORDERS:
+        assert json_row_ids(table, order_by) == brute_force_order(rows + more_rows, order_by)
+
+def test_order_by_rejects_unknown_direction():
+    table = DataTable(ORDER_DESCRIPTION)
+    table.LoadData(random_order_rows(random.Random(0), 5))
+    with pytest.raises(DataTableException):
+        table.ToJSon(None, [('a', 'up')])
@@ -0,0 +1,171 @@
+import random
+
+import pytest
+
+from ahocorapy.keywordtree import (CompactKeywordTree, KeywordTree, LEFTMOST_LONGEST, MATCH_POLICIES,
+                                   OVERLAPPING, RIGHTMOST_LONGEST)
+
+# Small alphabets, so the random keywords overlap and share suffixes a lot.
+ALPHABETS = ['ab', 'abc', 'abcd', '中文国人']
+
+def random_keywords(rng, alphabet):
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 5)))
+            for _ in range(rng.randint(1, 25))]
+
+def random_text(rng, alphabet):
+    # With characters that aren't in any keyword.
+    return ''.join(rng.choice(alphabet + 'x') for _ in range(rng.randint(0, 30)))
+
+def build_tree(keywords):
+    kwtree = KeywordTree()
+    for keyword in keywords:
+        kwtree.add(keyword)
+    kwtree.finalize()
+    return kwtree
+
+def brute_force_search_all(keywords, text):
+    return sorted({(keyword, start) for keyword in keywords
+                   for start in range(len(text) - len(keyword) + 1)
+                   if text.startswith(keyword, start)})
+
+def brute_force_ids(keywords, text):
+    keyword_ids = {keyword: keyword_id for keyword_id, keyword in enumerate(dict.fromkeys(keywords))}
+    return {keyword_ids[keyword] for keyword, _ in brute_force_search_all(keywords, text)}
+
+def brute_force_segment(keywords, text, policy):
+    segments = []
+    if policy == LEFTMOST_LONGEST:
+        start = 0
+        while start < len(text):
+            matches = [keyword for keyword in keywords if text.startswith(keyword, start)]
+            if matches:
+                longest = max(matches, key=len)
+                segments.append((longest, start))
+                start += len(longest)
+            else:
+                start += 1
+    else:
+        end = len(text)
+        while end > 0:
+            matches = [keyword for keyword in keywords if text.endswith(keyword, 0, end)]
+            if matches:
+                longest = max(matches, key=len)
+                end -= len(longest)
+                segments.append((longest, end))
+            else:
+                end -= 1
+        segments.reverse()
+    return segments
+
+def random_cases(seed, count=300):
+    rng = random.Random(seed)
+    for _ in range(count):
+        alphabet = rng.choice(ALPHABETS)
+        keywords = random_keywords(rng, alphabet)
+        texts = [random_text(rng, alphabet) for _ in range(5)]
+        yield rng, keywords, texts
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_search_all_matches_brute_force(compact):
+    for _, keywords, texts in random_cases(1):
+        kwtree = build_tree(keywords)
+        if compact:
+            kwtree = kwtree.compact()
+        for text in texts:
+            assert sorted(kwtree.search_all(text)) == brute_force_search_all(keywords, text)
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_search_ids_matches_brute_force(compact):
+    for _, keywords, texts in random_cases(2):
+        kwtree = build_tree(keywords)
+        if compact:
+            kwtree = kwtree.compact()
+        assert list(kwtree.search_ids(texts)) == [brute_force_ids(keywords, text) for text in texts]
+
+        # Every keyword is reported for the first text it is in only.
+        seen = set()
+        reported = set()
+        for found, text in zip(kwtree.search_ids(texts, seen), texts):
+            assert found == brute_force_ids(keywords, text) - reported
+            reported |= found
+        assert seen == reported
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('policy', [LEFTMOST_LONGEST, RIGHTMOST_LONGEST])
+def test_search_words_matches_brute_force(compact, policy):
+    for _, keywords, texts in random_cases(3):
+        kwtree = build_tree(keywords)
+        if compact:
+            kwtree = kwtree.compact()
+        keyword_ids = {keyword: keyword_id for keyword_id, keyword in enumerate(dict.fromkeys(keywords))}
+        for text in texts:
+            segments = brute_force_segment(keywords, text, policy)
+            assert list(kwtree.search_words(text, policy)) == segments
+            assert list(kwtree.search_ids([text], policy=policy)) == \
+                [{keyword_ids[keyword] for keyword, _ in segments}]
+
+def test_unknown_policy():
+    kwtree = build_tree(['ab'])
+    assert 'unknown' not in MATCH_POLICIES
+    with pytest.raises(ValueError):
+        list(kwtree.search_ids(['ab'], policy='unknown'))
+
+def test_add_after_finalize_matches_rebuild():
+    for rng, keywords, texts in random_cases(4):
+        # Part of the keywords are added after finalize().
+        num_finalized = rng.randint(0, len(keywords))
+        kwtree = build_tree(keywords[:num_finalized])
+        for keyword in keywords[num_finalized:]:
+            kwtree.add(keyword)
+        rebuilt = build_tree(keywords)
+        for text in texts:
+            assert list(kwtree.search_all(text)) == list(rebuilt.search_all(text))
+            for policy in (LEFTMOST_LONGEST, RIGHTMOST_LONGEST):
+                assert list(kwtree.search_words(text, policy)) == list(rebuilt.search_words(text, policy))
+        assert list(kwtree.search_ids(texts)) == list(rebuilt.search_ids(texts))
+        compact = kwtree.compact()
+        for text in texts:
+            assert list(compact.search_all(text)) == list(rebuilt.search_all(text))
+
+def test_add_after_finalize_with_payloads():
+    kwtree = build_tree(['中文', '国人'])
+    kwtree.add('中国', (1, 2))
+    kwtree.add('人', (3, 4))
+    assert sorted(kwtree.search_all_with_payloads('中国人')) == [('中国', 0, (1, 2)), ('人', 2, (3, 4)),
+                                                               ('国人', 1, None)]
+    assert list(kwtree.search_ids(['中国人'], policy=OVERLAPPING)) == [{1, 2, 3}]
+
+@pytest.mark.parametrize('payloads', [[(1, 2), (3, 4), (5, 6)], [(1, 300), (3, 4), (5, 6)]])
+def test_save_load_round_trip(tmp_path, payloads):
+    # Byte and int32 payloads.
+    kwtree = KeywordTree(case_insensitive=True)
+    for keyword, payload in zip(['中文', '中国', 'Ab'], payloads):
+        kwtree.add(keyword, payload)
+    kwtree.finalize()
+    compact = kwtree.compact()
+    path = str(tmp_path / 'tree.kwt')
+    compact.save(path)
+    loaded = CompactKeywordTree.load(path)
+    assert len(loaded) == len(compact) == 3
+    assert [loaded.keyword(keyword_id) for keyword_id in range(3)] == ['中文', '中国', 'Ab']
+    assert [loaded.payload(keyword_id) for keyword_id in range(3)] == payloads
+    assert list(loaded.payload_column(1)) == [payload[1] for payload in payloads]
+    for text in ['我们说中文', '中国人', 'xaBx', '']:
+        assert list(loaded.search_all(text)) == list(compact.search_all(text))
+        assert list(loaded.search_ids([text])) == list(compact.search_ids([text]))
+
+def test_load_rejects_damaged_files(tmp_path):
+    kwtree = build_tree(['中文', '中国', '国人'])
+    path = str(tmp_path / 'tree.kwt')
+    kwtree.compact().save(path)
+    with open(path, 'rb') as tree_file:
+        data = tree_file.read()
+    damaged_path = str(tmp_path / 'damaged.kwt')
+    damaged_files = [data[:size] for size in (0, 10, 50, len(data) // 2, len(data) - 3, len(data) - 1)]
+    damaged_files.append(data + b'\0')
+    damaged_files.append(b'x' * len(data))
+    for damaged in damaged_files:
+        with open(damaged_path, 'wb') as damaged_file:
+            damaged_file.write(damaged)
+        with pytest.raises(ValueError):
+            CompactKeywordTree.load(damaged_path)
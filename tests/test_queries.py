@@ -0,0 +1,77 @@
+import random
+import sqlite3
+
+import pytest
+
+import queries
+from queries import FIELD_SEPARATOR, search_field_texts, studied_notes_query
+
+def create_collection(rng):
+    # The tables of an Anki collection the queries touch, with notes of
+    # several decks and models, cards that weren't studied or reviewed, and
+    # notes with fewer fields than others.
+    db = sqlite3.connect(':memory:')
+    db.executescript("""
+        create table notes (id integer primary key, mid integer not null, flds text not null);
+        create table cards (id integer primary key, nid integer not null, did integer not null,
+                            queue integer not null);
+        create table revlog (id integer primary key, cid integer not null);
+    """)
+    card_id = 0
+    review_ids = rng.sample(range(1, 10 ** 6), 2000)
+    for note_id in range(1, 201):
+        fields = ['note {} field {}'.format(note_id, ord) for ord in range(rng.randint(1, 3))]
+        db.execute("insert into notes values (?, ?, ?)", (note_id, rng.randint(1, 3), FIELD_SEPARATOR.join(fields)))
+        for _ in range(rng.randint(1, 3)):
+            card_id += 1
+            db.execute("insert into cards values (?, ?, ?, ?)",
+                       (card_id, note_id, rng.randint(1, 3), rng.choice([0, 1, 2])))
+            for _ in range(rng.randint(0, 3)):
+                db.execute("insert into revlog values (?, ?)", (review_ids.pop(), card_id))
+    return db
+
+def brute_force_texts(db, search_field_ords):
+    # The search field of every note, for its first reviewed studied card in
+    # a configured deck and model, in order of that review.
+    first_cards = dict()
+    for note_id, model_id, deck_id, fields, first_review in db.execute(
+            "select notes.id, notes.mid, cards.did, notes.flds, min(revlog.id) from notes, cards, revlog "
+            "where notes.id=cards.nid and cards.id=revlog.cid and cards.queue>0 group by cards.id"):
+        field_ord = search_field_ords.get((deck_id, model_id))
+        if field_ord is None:
+            continue
+        if note_id not in first_cards or first_review < first_cards[note_id][2]:
+            note_fields = fields.split(FIELD_SEPARATOR)
+            first_cards[note_id] = (note_id, note_fields[field_ord] if field_ord < len(note_fields) else None,
+                                    first_review)
+    return sorted((row for row in first_cards.values() if row[1] is not None), key=lambda row: row[2])
+
+@pytest.mark.parametrize('notes_per_batch', [1, 7, 1000])
+def test_search_field_texts_matches_brute_force(monkeypatch, notes_per_batch):
+    monkeypatch.setattr(queries, 'NOTES_PER_BATCH', notes_per_batch)
+    rng = random.Random(notes_per_batch)
+    for _ in range(20):
+        db = create_collection(rng)
+        search_field_ords = {(deck_id, model_id): rng.randint(0, 2)
+                             for deck_id in range(1, 4) for model_id in range(1, 4) if rng.random() < 0.7}
+        if not search_field_ords:
+            continue
+        model_ids_for_deck = dict()
+        for deck_id, model_id in search_field_ords:
+            model_ids_for_deck.setdefault(deck_id, []).append(model_id)
+        studied_notes = db.execute(studied_notes_query(model_ids_for_deck)).fetchall()
+        texts = list(search_field_texts(db, studied_notes, search_field_ords))
+        assert texts == brute_force_texts(db, search_field_ords)
+
+def test_search_field_texts_skips_deleted_notes(monkeypatch):
+    monkeypatch.setattr(queries, 'NOTES_PER_BATCH', 10)
+    db = create_collection(random.Random(0))
+    search_field_ords = {(deck_id, model_id): 0 for deck_id in range(1, 4) for model_id in range(1, 4)}
+    model_ids_for_deck = {deck_id: [1, 2, 3] for deck_id in range(1, 4)}
+    studied_notes = db.execute(studied_notes_query(model_ids_for_deck)).fetchall()
+    texts = search_field_texts(db, studied_notes, search_field_ords)
+    first_text = next(texts)
+    # Deleted while the notes are streamed, after the first batch was read.
+    deleted_note_id = studied_notes[-1][0]
+    db.execute("delete from notes where id=?", (deleted_note_id,))
+    assert [first_text] + list(texts) == brute_force_texts(db, search_field_ords)
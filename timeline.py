@@ -0,0 +1,64 @@
+import datetime
+import itertools
+import time
+from typing import Dict, List, Tuple
+
+# NumPy isn't bundled with Anki, the counts are summed in Python without it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The stats count days as integers, the number of days since 1970-01-01 in
+# the local timezone, with the day starting at Anki's rollover hour like
+# the days of the scheduler.
+SECONDS_PER_DAY = 86400
+epoch_date = datetime.date(1970, 1, 1)
+
+def days_for_times(epoch_ms_list, rollover_hour: int) -> List[int]:
+    # The UTC offset only changes with daylight saving time, so it is looked
+    # up once per hour instead of once per time.
+    rollover = rollover_hour * 3600
+    offset_for_hour = dict()
+    days = []
+    for epoch_ms in epoch_ms_list:
+        epoch = epoch_ms // 1000
+        hour = epoch // 3600
+        offset = offset_for_hour.get(hour)
+        if offset is None:
+            offset = offset_for_hour[hour] = time.localtime(epoch).tm_gmtoff
+        days.append((epoch + offset - rollover) // SECONDS_PER_DAY)
+    return days
+
+def date_for_day(day: int) -> datetime.date:
+    return epoch_date + datetime.timedelta(days=day)
+
+def cumulative_counts_by_day(days_for_key: Dict[str, List[int]]) -> Tuple[List[int], Dict[str, List[int]]]:
+    # Counts the days of every key, and returns the days on which anything
+    # was counted, in order, with the running total of every key on those days.
+    all_days = list(itertools.chain.from_iterable(days_for_key.values()))
+    if not all_days:
+        return [], {key: [] for key in days_for_key}
+    first_day = min(all_days)
+    num_days = max(all_days) - first_day + 1
+
+    if numpy is not None:
+        counted_days = numpy.flatnonzero(numpy.bincount(numpy.array(all_days) - first_day, minlength=num_days))
+        cumulative_counts = dict()
+        for key, days in days_for_key.items():
+            counts = numpy.bincount(numpy.array(days, dtype=numpy.int64) - first_day, minlength=num_days)
+            cumulative_counts[key] = numpy.cumsum(counts)[counted_days].tolist()
+        return (counted_days + first_day).tolist(), cumulative_counts
+
+    is_counted = [False] * num_days
+    for day in all_days:
+        is_counted[day - first_day] = True
+    counted_days = [index for index, counted in enumerate(is_counted) if counted]
+    cumulative_counts = dict()
+    for key, days in days_for_key.items():
+        counts = [0] * num_days
+        for day in days:
+            counts[day - first_day] += 1
+        running_totals = list(itertools.accumulate(counts))
+        cumulative_counts[key] = [running_totals[index] for index in counted_days]
+    return [index + first_day for index in counted_days], cumulative_counts
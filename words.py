@@ -0,0 +1,110 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import Tuple
+
+from .lib.ahocorapy.keywordtree import KeywordTree, CompactKeywordTree
+
+addon_directory = os.path.dirname(__file__)
+# Anki keeps this directory when the add-on is upgraded.
+user_files_directory = os.path.join(addon_directory, 'user_files')
+
+# Bump when the keywords or payloads of the words tree change.
+WORDS_TREE_VERSION = 2
+
+# The words of the frequency list are added to the words tree first, in
+# order, so the keyword id of a word is its frequency rank. The payload of
+# every word is (hsk level, number of stars).
+HSK_LEVEL = 0
+NUM_STARS = 1
+NOT_IN_HSK = 0
+NOT_IN_FREQ_LIST = 255
+
+def freq_num_stars(freq: int) -> int:
+    if freq <= 1500:
+        return 5
+    elif freq <= 5000:
+        return 4
+    elif freq <= 15000:
+        return 3
+    elif freq <= 30000:
+        return 2
+    elif freq <= 60000:
+        return 1
+    else:
+        return 0
+
+hsk_file_path = os.path.join(addon_directory, 'hsk.json')
+freq_file_path = os.path.join(addon_directory, 'freq.txt')
+
+def load_hsk_data():
+    with open(hsk_file_path, encoding='utf_8_sig') as hsk_file:
+        return json.load(hsk_file)
+
+def load_freq_data():
+    with open(freq_file_path, encoding='utf_8_sig') as freq_file:
+        return freq_file.read().splitlines()
+
+def build_words_tree() -> KeywordTree:
+    # One tree over the union of the HSK and frequency word lists, so a
+    # single scan feeds both the HSK and the frequency stats.
+    hsk_data = load_hsk_data()
+    freq_data = load_freq_data()
+
+    kwtree = KeywordTree(case_insensitive=True)
+    for freq, word in enumerate(freq_data):
+        hsk_level = hsk_data.get(word, NOT_IN_HSK)
+        kwtree.add(word, (hsk_level, freq_num_stars(freq)))
+    freq_words = set(freq_data)
+    for word, hsk_level in hsk_data.items():
+        if word not in freq_words:
+            kwtree.add(word, (hsk_level, NOT_IN_FREQ_LIST))
+    kwtree.finalize()
+    return kwtree
+
+def words_tree_key() -> str:
+    # Changes whenever the word lists, the tree contents or the file format
+    # change, so an upgraded add-on never picks up a stale tree.
+    key = hashlib.sha256()
+    key.update('{}.{}'.format(WORDS_TREE_VERSION, CompactKeywordTree.FORMAT_VERSION).encode())
+    for file_path in [freq_file_path, hsk_file_path]:
+        with open(file_path, 'rb') as word_list_file:
+            key.update(word_list_file.read())
+    return key.hexdigest()[:16]
+
+def load_words_tree() -> Tuple[CompactKeywordTree, str]:
+    # Open the cached tree for the current word lists, building it first
+    # if it is missing, stale or unreadable. Returns the tree and its
+    # words_tree_key(), which takes reading the word lists to compute.
+    key = words_tree_key()
+    words_tree_file_path = os.path.join(user_files_directory, 'words_tree-{}.kwt'.format(key))
+    if os.path.exists(words_tree_file_path):
+        try:
+            return CompactKeywordTree.load(words_tree_file_path), key
+        except Exception:
+            # Whatever is wrong with the file, it is deleted with the
+            # stale ones below and rebuilt, the stats must always start.
+            pass
+
+    words_tree = build_words_tree().compact()
+    try:
+        os.makedirs(user_files_directory, exist_ok=True)
+        stale_file_paths = glob.glob(os.path.join(user_files_directory, 'words_tree-*'))
+        for stale_file_path in stale_file_paths:
+            os.remove(stale_file_path)
+        # Write to a temporary file first, so that an interrupted build
+        # never leaves a truncated tree behind.
+        temp_file, temp_file_path = tempfile.mkstemp(dir=user_files_directory, prefix='words_tree-', suffix='.tmp')
+        os.close(temp_file)
+        try:
+            words_tree.save(temp_file_path)
+            os.replace(temp_file_path, words_tree_file_path)
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+        return CompactKeywordTree.load(words_tree_file_path), key
+    except Exception:
+        # The tree still works from memory, it is just rebuilt next time.
+        return words_tree, key